@@ -3,17 +3,44 @@
 Pre-compute all ML results and save as JSON files.
 This eliminates Python runtime overhead - results load instantly from JSON.
 
-Run: python ml-scripts/precompute_results.py
+Run: python ml-scripts/precompute_results.py [--subprocess]
+
+By default the ML scripts are imported and called in-process so numpy, pandas
+and sklearn are only imported once. Pass --subprocess to run the jobs in
+separate long-lived worker processes (ml-scripts/worker.py) instead.
 """
 
+import argparse
+import hashlib
 import json
+import multiprocessing
 import os
+import signal
 import sys
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
+import sklearn
+import xgboost as xgb
+from threadpoolctl import threadpool_limits
+
+try:
+    import orjson
+except ImportError:  # Fall back to the standard library encoder
+    orjson = None
+
 # Add parent directory to path to import our ML modules
 sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from run_ensemble import run_ensemble_sweep as reg_sweep
+from run_ensemble_analysis import run_ensemble_sweep as cls_sweep
 
 # Configuration
 DATASETS = {
@@ -27,128 +54,337 @@ META_LEARNERS = ['linear', 'random_forest', 'xgboost']  # For stacking only
 PROJECT_ROOT = Path(__file__).parent.parent
 OUTPUT_DIR = PROJECT_ROOT / 'public' / 'precomputed-results'
 DATASETS_DIR = PROJECT_ROOT / 'data'
+WORKER_SCRIPT = PROJECT_ROOT / 'ml-scripts' / 'worker.py'
+JOB_TIMEOUT = 300  # Seconds allowed per combination
+POLL_INTERVAL = 0.5  # Seconds between checks on running pool jobs
+WORKER_LOG_DIR = PROJECT_ROOT / '.cache' / 'worker-logs'
+CODE_ROOTS = (PROJECT_ROOT / 'ml-scripts', PROJECT_ROOT / 'ml_engine')  # Code the results depend on
+
+def _normalized_bytes(path):
+    """File bytes with CRLF line endings as LF, so a Windows checkout hashes the same."""
+    return path.read_bytes().replace(b'\r\n', b'\n')
+
+@lru_cache(maxsize=1)
+def code_sha256():
+    """SHA-256 of every .py file under CODE_ROOTS and the library versions the results come from."""
+    digest = hashlib.sha256()
+    for root in CODE_ROOTS:
+        for path in sorted(root.rglob('*.py')):
+            digest.update(path.relative_to(PROJECT_ROOT).as_posix().encode('utf-8') + b'\0')
+            digest.update(_normalized_bytes(path))
+    for module in (np, pd, sklearn, xgb):
+        digest.update(f"{module.__name__}={module.__version__}\0".encode('utf-8'))
+    return digest.hexdigest()
+
+def inputs_sha256(csv_path):
+    """
+    SHA-256 of everything a dataset's results depend on: its CSV and code_sha256().
+    
+    Recorded per dataset in index.json, so verify_results.py can tell whether
+    the committed results were generated from the current inputs.
+    """
+    digest = hashlib.sha256(_normalized_bytes(Path(csv_path)))
+    digest.update(code_sha256().encode('utf-8'))
+    return digest.hexdigest()
+
+def file_sha256(path):
+    """SHA-256 of a results file, recorded with its index.json entry so edits to it show."""
+    return hashlib.sha256(_normalized_bytes(Path(path))).hexdigest()
 
 def ensure_output_dir():
     """Create output directory if it doesn't exist."""
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     print(f"[OK] Output directory: {OUTPUT_DIR}")
 
-def run_python_ml(dataset_id, meta_learner):
-    """Run the Python ML script and return parsed results."""
-    csv_file = DATASETS[dataset_id]
-    csv_path = DATASETS_DIR / csv_file
+def worker_log(index):
+    """Path of the file collecting one worker's stderr."""
+    return WORKER_LOG_DIR / f'worker-{index}.log'
+
+def start_workers(count):
+    """Spawn long-lived worker processes that keep the ML stack imported."""
+    # close_fds=False keeps Popen on the posix_spawn fast path instead of
+    # scanning the fd table. Nothing leaks: Python creates fds (including the
+    # other workers' pipe ends) non-inheritable, so each worker only gets its
+    # own stdin/stdout/stderr. Training progress and any crash output go to
+    # the workers' stderr, one log file each, so it doesn't interleave with
+    # this script's output; failures come back as framed {'error': ...} results.
+    # Each worker's OpenMP/BLAS pools get the same core share as its n_jobs,
+    # so nested thread pools don't oversubscribe the machine
+    WORKER_LOG_DIR.mkdir(parents=True, exist_ok=True)
+    ignore_file = WORKER_LOG_DIR.parent / '.gitignore'
+    if not ignore_file.exists():
+        ignore_file.write_text('*\n')
+    
+    env = os.environ.copy()
+    env.setdefault('OMP_NUM_THREADS', str(inner_jobs(count)))
+    workers = []
+    for index in range(count):
+        # The child keeps its own copy of the log fd once spawned
+        with open(worker_log(index), 'wb') as log:
+            workers.append(subprocess.Popen([sys.executable, str(WORKER_SCRIPT)],
+                                            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            stderr=log, close_fds=False, env=env))
+    return workers
+
+def read_result(worker, timeout=JOB_TIMEOUT):
+    """
+    Read one length-prefixed JSON result from a worker's stdout.
     
-    # Determine which script to use
-    is_classification = dataset_id == 'loan'
-    script_name = 'run_ensemble_analysis.py' if is_classification else 'run_ensemble.py'
-    script_path = PROJECT_ROOT / 'ml-scripts' / script_name
+    The worker is killed if the result has not fully arrived within timeout
+    seconds, which ends the blocking read instead of hanging forever.
+    """
+    timed_out = threading.Event()
+    def expire():
+        timed_out.set()
+        worker.kill()
     
-    # Build command
-    if is_classification:
-        config = json.dumps({'meta_learner': meta_learner})
-        cmd = [sys.executable, str(script_path), str(csv_path), 'both', config]
+    timer = threading.Timer(timeout, expire)
+    timer.daemon = True
+    timer.start()
+    try:
+        header = worker.stdout.read(4)
+        payload = bytearray(int.from_bytes(header, 'big')) if len(header) == 4 else None
+        complete = payload is not None and worker.stdout.readinto(payload) == len(payload)
+    finally:
+        timer.cancel()
+    
+    if timed_out.is_set():
+        raise TimeoutError(f"Worker gave no result within {timeout}s and was killed")
+    if payload is None:
+        raise Exception(f"Worker exited with code {worker.wait()} before returning a result")
+    if not complete:
+        raise Exception(f"Worker exited with code {worker.wait()} mid-result")
+    # Parse the UTF-8 bytes directly; no intermediate str is built
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+def write_json(output_file, data):
+    """Write a result payload as compact JSON (orjson when available)."""
+    if orjson is not None:
+        output_file.write_bytes(orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY))
     else:
-        cmd = [sys.executable, str(script_path), str(csv_path), meta_learner]
+        with open(output_file, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+
+def output_name(dataset_id, method, meta_learner):
+    """Return the JSON file name for a (dataset, method, meta-learner) combination."""
+    if method == 'voting':
+        return f"{dataset_id}-voting.json"
+    return f"{dataset_id}-stacking-{meta_learner}.json"
+
+def index_entry(dataset_id, method, meta_learner=None):
+    """Return the index.json entry describing one combination's file."""
+    entry = {'dataset': dataset_id, 'method': method}
+    if method == 'stacking':
+        entry['meta_learner'] = meta_learner
+    entry['file'] = output_name(dataset_id, method, meta_learner)
+    return entry
+
+def _index_order(entry):
+    """Sort key keeping the index in voting-then-stacking, configuration order."""
+    return (METHODS.index(entry['method']),
+            list(DATASETS).index(entry['dataset']),
+            META_LEARNERS.index(entry['meta_learner']) if 'meta_learner' in entry else -1)
+
+def _wrap(method, method_results, dataset_info):
+    """Build the JSON payload served for a single method."""
+    return {
+        'success': True,
+        'data': {
+            method: method_results,
+            'dataset_info': dataset_info
+        }
+    }
+
+def build_outputs(dataset_id, python_results):
+    """Split sweep results into (index entry, data) pairs, one per output file."""
+    if 'error' in python_results:
+        raise Exception(python_results['error'])
     
-    print(f"  Running: {' '.join(cmd)}")
+    dataset_info = python_results.get('dataset_info', {})
+    outputs = [(index_entry(dataset_id, 'voting'),
+                _wrap('voting', python_results.get('voting', {}), dataset_info))]
+    for meta_learner in META_LEARNERS:
+        outputs.append((index_entry(dataset_id, 'stacking', meta_learner),
+                        _wrap('stacking', python_results['stacking'][meta_learner], dataset_info)))
+    return outputs
+
+def inner_jobs(max_workers):
+    """Cores each worker may use for model training without oversubscribing."""
+    return max(1, (os.cpu_count() or 1) // max_workers)
+
+def analyze_dataset(dataset_id, n_jobs=1):
+    """
+    Compute voting and every stacking meta-learner for one dataset.
     
-    # Execute
-    result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+    The data is loaded and the base models and voting ensemble are trained
+    once; only the stacking final estimator changes per meta-learner.
+    Returns a list of (index entry, data) pairs.
+    """
+    csv_path = str(DATASETS_DIR / DATASETS[dataset_id])
+    if dataset_id == 'loan':
+        python_results = cls_sweep(csv_path, META_LEARNERS, {'n_jobs': n_jobs}, verbose=False)
+    else:
+        python_results = reg_sweep(csv_path, META_LEARNERS, verbose=False, n_jobs=n_jobs)
+    return build_outputs(dataset_id, python_results)
+
+_job_starts = None  # Queue a pool process announces (dataset_id, pid) on as it starts a job
+
+def _init_pool_process(job_starts, n_threads):
+    """
+    Pool initializer: keep the queue that job starts are reported on.
     
-    if result.returncode != 0:
-        raise Exception(f"Python script failed: {result.stderr}")
+    The process already has numpy and sklearn loaded, so OMP_NUM_THREADS
+    would come too late; threadpoolctl caps the loaded OpenMP/BLAS pools at
+    the process's core share instead, as start_workers does for workers.
+    """
+    global _job_starts
+    _job_starts = job_starts
+    threadpool_limits(limits=n_threads)
+
+def _analyze_in_pool(dataset_id, n_jobs):
+    """analyze_dataset in a pool process, first reporting which process runs it."""
+    _job_starts.put((dataset_id, os.getpid()))
+    return analyze_dataset(dataset_id, n_jobs)
+
+def _run_in_pool(max_workers):
+    """
+    Yield (dataset_id, outputs or exception) as process-pool jobs finish.
     
-    # Parse JSON output (same logic as actions.ts)
-    stdout = result.stdout
-    json_start = stdout.find("RESULTS_JSON_START")
-    json_end = stdout.find("RESULTS_JSON_END")
+    Each job gets JOB_TIMEOUT seconds from when a pool process picks it up.
+    A job still running after that is yielded as a TimeoutError and its
+    process is killed; multiprocessing.Pool replaces the process and carries
+    on with the queued jobs, and terminates the pool on exit rather than
+    waiting for stuck jobs.
+    """
+    job_starts = multiprocessing.SimpleQueue()
+    n_jobs = inner_jobs(max_workers)
+    with multiprocessing.Pool(max_workers, initializer=_init_pool_process,
+                              initargs=(job_starts, n_jobs)) as pool:
+        pending = {dataset_id: pool.apply_async(_analyze_in_pool, (dataset_id, n_jobs))
+                   for dataset_id in DATASETS}
+        running = {}  # dataset_id -> (pid, deadline)
+        
+        while pending:
+            while not job_starts.empty():
+                dataset_id, pid = job_starts.get()
+                running[dataset_id] = (pid, time.monotonic() + JOB_TIMEOUT)
+            
+            for dataset_id, result in list(pending.items()):
+                if result.ready():
+                    del pending[dataset_id]
+                    try:
+                        yield dataset_id, result.get()
+                    except Exception as e:
+                        yield dataset_id, e
+                elif dataset_id in running and time.monotonic() > running[dataset_id][1]:
+                    del pending[dataset_id]
+                    try:
+                        os.kill(running[dataset_id][0], signal.SIGTERM)
+                    except OSError:
+                        pass  # Exited in the meantime
+                    yield dataset_id, TimeoutError(f"Job gave no result within {JOB_TIMEOUT}s and was killed")
+            
+            if pending:
+                time.sleep(POLL_INTERVAL)
+
+def _run_on_workers(max_workers):
+    """Yield (dataset_id, outputs or exception) from warm subprocess workers."""
+    workers = start_workers(max_workers)
+    assigned = [[] for _ in workers]
+    try:
+        # Queue every job up front, round-robin, so all workers start at once
+        for i, dataset_id in enumerate(DATASETS):
+            job = {
+                'csv_path': str(DATASETS_DIR / DATASETS[dataset_id]),
+                'classification': dataset_id == 'loan',
+                'meta_learners': META_LEARNERS,
+                'n_jobs': inner_jobs(max_workers)
+            }
+            worker = workers[i % len(workers)]
+            worker.stdin.write((json.dumps(job) + '\n').encode('utf-8'))
+            worker.stdin.flush()
+            assigned[i % len(workers)].append(dataset_id)
+        
+        for worker in workers:
+            worker.stdin.close()
+        
+        # Each worker answers its jobs in the order they were sent
+        for index, (worker, dataset_ids) in enumerate(zip(workers, assigned)):
+            for dataset_id in dataset_ids:
+                try:
+                    result = read_result(worker)
+                except Exception as e:
+                    yield dataset_id, Exception(f"{e} (see {worker_log(index)})")
+                    continue
+                try:
+                    outputs = build_outputs(dataset_id, result)
+                except Exception as e:
+                    outputs = e
+                yield dataset_id, outputs
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.kill()
+            worker.wait()
+
+def precompute_all(use_subprocess=False, max_workers=None):
+    """
+    Pre-compute all combinations of datasets, methods, and meta-learners.
     
-    if json_start != -1 and json_end != -1:
-        json_str = stdout[json_start + len("RESULTS_JSON_START"):json_end].strip()
-        return json.loads(json_str)
-    else:
-        # Fallback: find JSON braces
-        first_brace = stdout.find("{")
-        last_brace = stdout.rfind("}")
-        if first_brace == -1 or last_brace == -1:
-            raise Exception("Could not find JSON in Python output")
-        json_str = stdout[first_brace:last_brace + 1]
-        return json.loads(json_str)
-
-def precompute_all():
-    """Pre-compute all combinations of datasets, methods, and meta-learners."""
+    index.json is written at the end and lists only the combinations whose
+    results were computed and saved successfully.
+    """
     ensure_output_dir()
     
     total_combinations = len(DATASETS) * (1 + len(META_LEARNERS))  # 1 voting + N stacking
+    max_workers = max_workers or min(len(DATASETS), os.cpu_count() or 1)
     current = 0
     
-    print(f"\nStarting pre-computation of {total_combinations} combinations...\n")
+    print(f"\nStarting pre-computation of {total_combinations} combinations "
+          f"on {max_workers} worker(s)...\n")
     
-    for dataset_id in DATASETS.keys():
-        print(f"\n{'='*60}")
-        print(f"Dataset: {dataset_id.upper()}")
-        print(f"{'='*60}")
-        
-        # Voting (run with any meta-learner, extract voting results)
-        current += 1
-        print(f"\n[{current}/{total_combinations}] Computing Voting for {dataset_id}...")
-        try:
-            python_results = run_python_ml(dataset_id, 'linear')
-            
-            # Save complete results (includes both voting and stacking)
-            output_file = OUTPUT_DIR / f"{dataset_id}-voting.json"
-            
-            # Extract just voting data
-            voting_data = {
-                'success': True,
-                'data': {
-                    'voting': python_results.get('voting', {}),
-                    'dataset_info': python_results.get('dataset_info', {})
-                }
-            }
+    run_jobs = _run_on_workers if use_subprocess else _run_in_pool
+    
+    # Writes go to a small thread pool so collecting the next result is
+    # never blocked on disk I/O
+    writes = []
+    with ThreadPoolExecutor(max_workers=2) as io_pool:
+        for dataset_id, outputs in run_jobs(max_workers):
+            print(f"\n{'='*60}")
+            print(f"Dataset: {dataset_id.upper()}")
+            print(f"{'='*60}")
             
-            with open(output_file, 'w') as f:
-                json.dump(voting_data, f, indent=2)
+            if isinstance(outputs, Exception):
+                print(f"  [ERROR] {str(outputs)}")
+                error_result = {'success': False, 'error': str(outputs)}
+                outputs = [(index_entry(dataset_id, 'voting'), error_result)]
+                outputs += [(index_entry(dataset_id, 'stacking', meta_learner), error_result)
+                            for meta_learner in META_LEARNERS]
             
-            print(f"  [OK] Saved: {output_file.name}")
-                    
-        except Exception as e:
-            print(f"  [ERROR] {str(e)}")
-            error_result = {'success': False, 'error': str(e)}
-            output_file = OUTPUT_DIR / f"{dataset_id}-voting.json"
-            with open(output_file, 'w') as f:
-                json.dump(error_result, f, indent=2)
+            for entry, data in outputs:
+                output_file = OUTPUT_DIR / entry['file']
+                writes.append((io_pool.submit(write_json, output_file, data), entry, data))
+            print(f"  Computed {len(outputs)} result(s), writing in background")
         
-        # Stacking with different meta-learners
-        for meta_learner in META_LEARNERS:
+        index_entries = []
+        for write, entry, data in writes:
             current += 1
-            print(f"\n[{current}/{total_combinations}] Computing Stacking ({meta_learner}) for {dataset_id}...")
             try:
-                python_results = run_python_ml(dataset_id, meta_learner)
-                
-                # Save stacking results
-                output_file = OUTPUT_DIR / f"{dataset_id}-stacking-{meta_learner}.json"
-                
-                # Extract just stacking data
-                stacking_data = {
-                    'success': True,
-                    'data': {
-                        'stacking': python_results.get('stacking', {}),
-                        'dataset_info': python_results.get('dataset_info', {})
-                    }
-                }
-                
-                with open(output_file, 'w') as f:
-                    json.dump(stacking_data, f, indent=2)
-                
-                print(f"  [OK] Saved: {output_file.name}")
-                        
-            except Exception as e:
-                print(f"  [ERROR] {str(e)}")
-                error_result = {'success': False, 'error': str(e)}
-                output_file = OUTPUT_DIR / f"{dataset_id}-stacking-{meta_learner}.json"
-                with open(output_file, 'w') as f:
-                    json.dump(error_result, f, indent=2)
+                write.result()
+            except OSError as e:
+                print(f"[{current}/{total_combinations}] [ERROR] Could not write {entry['file']}: {e}")
+                continue
+            status = 'OK' if data.get('success') else 'ERROR'
+            print(f"[{current}/{total_combinations}] [{status}] Saved: {entry['file']}")
+            if data.get('success'):
+                index_entries.append({**entry, 'sha256': file_sha256(OUTPUT_DIR / entry['file'])})
+    
+    computed = {entry['dataset'] for entry in index_entries}
+    write_index(sorted(index_entries, key=_index_order),
+                {dataset_id: inputs_sha256(DATASETS_DIR / csv_file)
+                 for dataset_id, csv_file in DATASETS.items() if dataset_id in computed})
     
     print(f"\n{'='*60}")
     print(f"Pre-computation complete!")
@@ -157,33 +393,16 @@ def precompute_all():
     print(f"Total files: {len(list(OUTPUT_DIR.glob('*.json')))}")
     print(f"\nYour app will now load results instantly from JSON!\n")
 
-def create_index():
-    """Create an index file listing all available results."""
+def write_index(combinations, inputs=None):
+    """Write the index file listing the available results and the inputs_sha256 they came from."""
     index = {
         'datasets': list(DATASETS.keys()),
         'methods': METHODS,
         'meta_learners': META_LEARNERS,
-        'combinations': []
+        'combinations': combinations,
+        'inputs': inputs or {}
     }
     
-    # Add voting combinations
-    for dataset_id in DATASETS.keys():
-        index['combinations'].append({
-            'dataset': dataset_id,
-            'method': 'voting',
-            'file': f"{dataset_id}-voting.json"
-        })
-    
-    # Add stacking combinations
-    for dataset_id in DATASETS.keys():
-        for meta_learner in META_LEARNERS:
-            index['combinations'].append({
-                'dataset': dataset_id,
-                'method': 'stacking',
-                'meta_learner': meta_learner,
-                'file': f"{dataset_id}-stacking-{meta_learner}.json"
-            })
-    
     index_file = OUTPUT_DIR / 'index.json'
     with open(index_file, 'w') as f:
         json.dump(index, f, indent=2)
@@ -191,6 +410,13 @@ def create_index():
     print(f"[OK] Created index: {index_file.name}")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pre-compute all ML results as JSON files.")
+    parser.add_argument('--subprocess', action='store_true',
+                        help="Run jobs in separate long-lived worker processes")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of parallel workers (default: CPU count)")
+    args = parser.parse_args()
+    
     print("\n" + "="*60)
     print("Ensemble ML Pre-computation Script")
     print("="*60)
@@ -199,8 +425,7 @@ if __name__ == '__main__':
     print("\n" + "="*60 + "\n")
     
     try:
-        precompute_all()
-        create_index()
+        precompute_all(use_subprocess=args.subprocess, max_workers=args.workers)
         
         print("\nSuccess! Your app is now blazing fast!")
         print("\nNext steps:")
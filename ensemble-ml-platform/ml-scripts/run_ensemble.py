@@ -4,31 +4,179 @@ Ensemble ML Script - Runs Voting and Stacking Regressors
 import sys
 import os
 import json
+import math
 import numpy as np
-import pandas as pd
-from sklearn.ensemble import VotingRegressor, StackingRegressor, RandomForestRegressor, GradientBoostingRegressor
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestRegressor, HistGradientBoostingRegressor
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import r2_score, mean_squared_error, mean_absolute_error
-from sklearn.model_selection import cross_val_score
+from sklearn.model_selection import KFold
 
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ml_engine'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from ml_engine.preprocessing.data_processor import load_and_preprocess_csv
-from scipy import stats
+from ml_engine.ensemble.xgb_config import make_xgb_regressor
 
-def run_ensemble_analysis(csv_path, meta_learner="linear"):
+# Unfitted base model configurations shared by the test-set fits and every CV fold
+BASE_ESTIMATORS = [
+    ('linear', LinearRegression()),
+    ('rf', RandomForestRegressor(n_estimators=100, random_state=42, max_depth=10, n_jobs=-1)),
+    ('xgb', HistGradientBoostingRegressor(max_iter=100, random_state=42, max_depth=5))
+]
+
+# Base models trained on the float32 copy of the features: the tree learners
+# work on float32 internally, so they get it without a cast on every fit and
+# predict. Linear Regression's least-squares solve keeps full float64 precision.
+FLOAT32_BASE_MODELS = {'rf', 'xgb'}
+
+# Display names of the base experts, in base prediction column order
+EXPERT_NAMES = {'linear': 'Linear Regression', 'rf': 'Random Forest', 'xgb': 'XGBoost'}
+
+# Keys of each predictions_sample row, in column order
+SAMPLE_KEYS = ('actual', 'predicted', 'linear_reg', 'random_forest', 'xgboost')
+
+def _quiet(*args, **kwargs):
+    """Drop progress output when running as a library call"""
+    pass
+
+def fresh_base_estimators(n_jobs=-1):
+    """Unfitted clones of BASE_ESTIMATORS, with n_jobs applied to the Random Forest"""
+    return [(name, clone(estimator).set_params(n_jobs=n_jobs) if name == 'rf' else clone(estimator))
+            for name, estimator in BASE_ESTIMATORS]
+
+def base_features(name, X, X32):
+    """The feature matrix base model name is trained on: X (float64) or its float32 copy X32"""
+    return X32 if name in FLOAT32_BASE_MODELS else X
+
+def oof_base_predictions(X, X32, y, n_jobs=-1):
+    """
+    Out-of-fold base model predictions on (X, y), one column per base model
+    
+    The same 5-fold KFold split a StackingRegressor uses to build the
+    training features of its final estimator. X32 is X as float32.
+    """
+    Z = np.empty((len(X), len(BASE_ESTIMATORS)))
+    for train_idx, val_idx in KFold(n_splits=5).split(X):
+        Z[val_idx] = np.column_stack([
+            model.fit(base_features(name, X, X32)[train_idx], y[train_idx])
+                 .predict(base_features(name, X, X32)[val_idx])
+            for name, model in fresh_base_estimators(n_jobs)
+        ])
+    return Z
+
+def _t_two_sided_p(t, df):
+    """
+    Two-sided p-value of Student's t for integer degrees of freedom
+    
+    Uses the closed-form series for the t distribution (Abramowitz & Stegun
+    26.7.3-4), which is exact for integer df.
+    """
+    theta = math.atan(abs(t) / math.sqrt(df))
+    sin_t, cos_t = math.sin(theta), math.cos(theta)
+    if df % 2:
+        series, term = 0.0, cos_t
+        for j in range(1, (df - 1) // 2 + 1):
+            series += term
+            term *= cos_t * cos_t * (2 * j) / (2 * j + 1)
+        inside = 2 / math.pi * (theta + sin_t * series)
+    else:
+        series, term = 0.0, 1.0
+        for j in range(1, df // 2 + 1):
+            series += term
+            term *= cos_t * cos_t * (2 * j - 1) / (2 * j)
+        inside = sin_t * series
+    return max(0.0, 1.0 - inside)
+
+def paired_ttest(a, b):
+    """Paired t-test of a against b, returning (t statistic, two-sided p-value)"""
+    d = np.asarray(a, dtype=float) - np.asarray(b, dtype=float)
+    n = len(d)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = d.mean() / (d.std(ddof=1) / np.sqrt(n))
+    if np.isnan(t):
+        return float('nan'), float('nan')
+    return float(t), _t_two_sided_p(t, n - 1)
+
+def predictions_sample(sample_indices, y_true, predicted, base_preds):
+    """Rows of actual, ensemble and base predictions for the sampled test points"""
+    # Index each column first so only the sampled rows are ever stacked
+    rows = np.column_stack([y_true[sample_indices], predicted[sample_indices],
+                            base_preds[sample_indices]]).tolist()
+    return [dict(zip(SAMPLE_KEYS, row)) for row in rows]
+
+def format_improvement(improvement):
+    """Format an improvement percentage with appropriate precision"""
+    if abs(improvement) < 0.1:
+        return f"<0.1%" if improvement >= 0 else f">-0.1%"
+    else:
+        return f"{improvement:.1f}%"
+
+def select_meta_learner(meta_learner, n_jobs=-1):
+    """
+    Build the stacking final estimator for a meta-learner id
+    
+    Args:
+        meta_learner: Meta-learner for stacking ('linear', 'random_forest', or 'xgboost')
+        n_jobs: Parallel jobs for the Random Forest and XGBoost meta-learners
+    
+    Returns:
+        Tuple of (unfitted estimator, display name)
+    """
+    if meta_learner == "random_forest":
+        return RandomForestRegressor(n_estimators=50, random_state=42, max_depth=5, n_jobs=n_jobs), "Random Forest"
+    elif meta_learner == "xgboost":
+        # XGBoost's default learning_rate of 0.3 overfits the three meta-features
+        return make_xgb_regressor(n_estimators=50, max_depth=3, learning_rate=0.1, n_jobs=n_jobs), "XGBoost"
+    else:  # default to linear
+        return LinearRegression(), "Linear Regression"
+
+def run_ensemble_analysis(csv_path, meta_learner="linear", verbose=True, n_jobs=-1, use_cache=True):
     """
     Run ensemble ML analysis (Voting & Stacking) on CSV data
     
     Args:
         csv_path: Path to CSV file
         meta_learner: Meta-learner for stacking ('linear', 'random_forest', or 'xgboost')
+        verbose: Print progress messages (disable when called in-process)
+        n_jobs: Parallel jobs for Random Forest training (-1 uses all cores)
+        use_cache: Read and write the preprocessed dataset cache
     
     Returns:
         Dictionary containing ensemble results
+    
+    Raises:
+        ValueError: If the dataset is a classification task
     """
-    print(f"Starting ensemble analysis with meta-learner: {meta_learner}")
-    print(f"Loading data from: {csv_path}")
+    results = run_ensemble_sweep(csv_path, [meta_learner], verbose=verbose, n_jobs=n_jobs, use_cache=use_cache)
+    results['stacking'] = results['stacking'][meta_learner]
+    return results
+
+def run_ensemble_sweep(csv_path, meta_learners, verbose=True, n_jobs=-1, use_cache=True):
+    """
+    Run ensemble ML analysis for several stacking meta-learners at once
+    
+    Data loading, the base models, the Voting Regressor and its
+    cross-validation are shared by every meta-learner, so they run once.
+    
+    Args:
+        csv_path: Path to CSV file
+        meta_learners: List of stacking meta-learners to evaluate
+        verbose: Print progress messages (disable when called in-process)
+        n_jobs: Parallel jobs for Random Forest training (-1 uses all cores;
+            lower it when several sweeps run side by side)
+        use_cache: Read and write the preprocessed dataset cache
+    
+    Returns:
+        Dictionary with 'voting', 'dataset_info' and a 'stacking' dict
+        keyed by meta-learner
+    
+    Raises:
+        ValueError: If the dataset is a classification task
+    """
+    log = print if verbose else _quiet
+    
+    log(f"Starting ensemble analysis with meta-learners: {', '.join(meta_learners)}")
+    log(f"Loading data from: {csv_path}")
     
     # Detect dataset from filename
     csv_filename = os.path.basename(csv_path).lower()
@@ -44,140 +192,88 @@ def run_ensemble_analysis(csv_path, meta_learner="linear"):
         target_variable = 'target'
     
     # Load and preprocess data
-    data = load_and_preprocess_csv(csv_path, test_size=0.3, random_state=42)
+    data = load_and_preprocess_csv(csv_path, test_size=0.3, random_state=42, use_cache=use_cache,
+                                   feature_dtype=np.float64)
     
     if data['is_classification']:
-        print("ERROR: Classification tasks not yet supported for ensembles")
-        sys.exit(1)
-    
-    X_train = data['X_train']
-    X_test = data['X_test']
-    y_train = data['y_train']
-    y_test = data['y_test']
+        raise ValueError("Classification tasks not yet supported for ensembles")
+    
+    # Features are loaded as float64 for Linear Regression, with a
+    # C-contiguous float32 copy cast once for the tree models
+    # (FLOAT32_BASE_MODELS). Targets stay float64 for the metrics and
+    # meta-learners.
+    X_train = np.ascontiguousarray(data['X_train'])
+    X_test = np.ascontiguousarray(data['X_test'])
+    X_train32 = np.ascontiguousarray(X_train, dtype=np.float32)
+    X_test32 = np.ascontiguousarray(X_test, dtype=np.float32)
+    y_train = np.ascontiguousarray(data['y_train'], dtype=np.float64)
+    y_test = np.ascontiguousarray(data['y_test'], dtype=np.float64)
     feature_names = data['feature_names']
     
-    print(f"Training ensemble models on {len(X_train)} samples...")
+    log(f"Training ensemble models on {len(X_train)} samples...")
     
     # Define base models
-    linear_model = LinearRegression()
-    rf_model = RandomForestRegressor(n_estimators=100, random_state=42, max_depth=10)
-    xgb_model = GradientBoostingRegressor(n_estimators=100, random_state=42, max_depth=5)
+    linear_model, rf_model, xgb_model = (model for _, model in fresh_base_estimators(n_jobs))
     
     # Train base models individually
-    print("Training Linear Regression...")
+    log("Training Linear Regression...")
     linear_model.fit(X_train, y_train)
     linear_pred = linear_model.predict(X_test)
     linear_r2 = r2_score(y_test, linear_pred)
     linear_rmse = np.sqrt(mean_squared_error(y_test, linear_pred))
     linear_mae = mean_absolute_error(y_test, linear_pred)
     
-    print("Training Random Forest...")
-    rf_model.fit(X_train, y_train)
-    rf_pred = rf_model.predict(X_test)
+    log("Training Random Forest...")
+    rf_model.fit(X_train32, y_train)
+    rf_pred = rf_model.predict(X_test32)
     rf_r2 = r2_score(y_test, rf_pred)
     rf_rmse = np.sqrt(mean_squared_error(y_test, rf_pred))
     rf_mae = mean_absolute_error(y_test, rf_pred)
     
-    print("Training XGBoost (Gradient Boosting)...")
-    xgb_model.fit(X_train, y_train)
-    xgb_pred = xgb_model.predict(X_test)
+    log("Training XGBoost (Histogram Gradient Boosting)...")
+    xgb_model.fit(X_train32, y_train)
+    xgb_pred = xgb_model.predict(X_test32)
     xgb_r2 = r2_score(y_test, xgb_pred)
     xgb_rmse = np.sqrt(mean_squared_error(y_test, xgb_pred))
     xgb_mae = mean_absolute_error(y_test, xgb_pred)
     
-    # Create Voting Regressor
-    print("Training Voting Regressor...")
-    voting_model = VotingRegressor([
-        ('linear', LinearRegression()),
-        ('rf', RandomForestRegressor(n_estimators=100, random_state=42, max_depth=10)),
-        ('xgb', GradientBoostingRegressor(n_estimators=100, random_state=42, max_depth=5))
-    ])
-    voting_model.fit(X_train, y_train)
-    voting_pred = voting_model.predict(X_test)
+    # Voting Regressor: an unweighted VotingRegressor averages its estimators'
+    # predictions, and refitting the same seeded base models would give the
+    # same estimators, so average the base predictions directly
+    log("Training Voting Regressor...")
+    base_preds = np.column_stack([linear_pred, rf_pred, xgb_pred])
+    voting_pred = base_preds.mean(axis=1)
     voting_r2 = r2_score(y_test, voting_pred)
     voting_rmse = np.sqrt(mean_squared_error(y_test, voting_pred))
     voting_mae = mean_absolute_error(y_test, voting_pred)
     
-    # Create Stacking Regressor with selected meta-learner
-    print(f"Training Stacking Regressor with {meta_learner} meta-learner...")
-    
-    # Select meta-learner based on parameter
-    if meta_learner == "random_forest":
-        final_estimator = RandomForestRegressor(n_estimators=50, random_state=42, max_depth=5)
-        meta_learner_name = "Random Forest"
-    elif meta_learner == "xgboost":
-        final_estimator = GradientBoostingRegressor(n_estimators=50, random_state=42, max_depth=3)
-        meta_learner_name = "XGBoost"
-    else:  # default to linear
-        final_estimator = LinearRegression()
-        meta_learner_name = "Linear Regression"
-    
-    stacking_model = StackingRegressor(
-        estimators=[
-            ('linear', LinearRegression()),
-            ('rf', RandomForestRegressor(n_estimators=100, random_state=42, max_depth=10)),
-            ('xgb', GradientBoostingRegressor(n_estimators=100, random_state=42, max_depth=5))
-        ],
-        final_estimator=final_estimator
-    )
-    stacking_model.fit(X_train, y_train)
-    stacking_pred = stacking_model.predict(X_test)
-    stacking_r2 = r2_score(y_test, stacking_pred)
-    stacking_rmse = np.sqrt(mean_squared_error(y_test, stacking_pred))
-    stacking_mae = mean_absolute_error(y_test, stacking_pred)
-    
-    # Extract meta-learner weights (if linear regression)
-    meta_weights = None
-    if isinstance(stacking_model.final_estimator_, LinearRegression):
-        try:
-            meta_weights = {
-                'linear': float(stacking_model.final_estimator_.coef_[0]),
-                'rf': float(stacking_model.final_estimator_.coef_[1]),
-                'xgb': float(stacking_model.final_estimator_.coef_[2])
-            }
-            # Normalize to percentages
-            total = sum(abs(w) for w in meta_weights.values())
-            if total > 0:
-                meta_weights = {k: abs(v)/total for k, v in meta_weights.items()}
-        except Exception as e:
-            print(f"Could not extract weights: {e}")
-    
-    # Get feature importance from Random Forest
-    feature_importance = dict(zip(feature_names, rf_model.feature_importances_))
-    # Normalize to percentages
-    total_importance = sum(feature_importance.values())
-    feature_importance = {k: float(v/total_importance) for k, v in feature_importance.items()}
+    # Get feature importance from Random Forest, normalized to percentages
+    importances = rf_model.feature_importances_
+    importances = importances / (importances.sum() or 1.0)
+    feature_importance = dict(zip(feature_names, importances.tolist()))
     
     # Analyze which expert wins in different scenarios
-    linear_errors = np.abs(linear_pred - y_test)
-    rf_errors = np.abs(rf_pred - y_test)
-    xgb_errors = np.abs(xgb_pred - y_test)
+    # One (n_test, 3) error matrix; argmin picks the first expert on ties
+    errors = np.abs(base_preds - y_test[:, None])
+    winners = np.argmin(errors, axis=1)
     
     # Count wins (who has lowest error for each prediction)
-    linear_wins = np.sum((linear_errors <= rf_errors) & (linear_errors <= xgb_errors))
-    rf_wins = np.sum((rf_errors < linear_errors) & (rf_errors <= xgb_errors))
-    xgb_wins = np.sum((xgb_errors < linear_errors) & (xgb_errors < rf_errors))
-    
-    expert_wins = {
-        'linear': int(linear_wins),
-        'rf': int(rf_wins),
-        'xgb': int(xgb_wins)
-    }
+    expert_wins = dict(zip(EXPERT_NAMES, np.bincount(winners, minlength=3).tolist()))
     
-    print(f"Expert wins: Linear={linear_wins}, RF={rf_wins}, XGBoost={xgb_wins}")
+    log(f"Expert wins: Linear={expert_wins['linear']}, RF={expert_wins['rf']}, XGBoost={expert_wins['xgb']}")
     
     # Find best performing expert
     best_expert = max(expert_wins, key=expert_wins.get)
-    best_expert_name = {'linear': 'Linear Regression', 'rf': 'Random Forest', 'xgb': 'XGBoost'}[best_expert]
+    best_expert_name = EXPERT_NAMES[best_expert]
     
     # Feature-stratified analysis: Which expert wins when?
-    print("Analyzing which expert wins in different scenarios...")
+    log("Analyzing which expert wins in different scenarios...")
     feature_insights = {}
     
     # Get most important feature
     if len(feature_names) > 0:
-        most_important_feature = max(feature_importance, key=feature_importance.get)
-        feature_idx = feature_names.index(most_important_feature)
+        feature_idx = int(np.argmax(importances))
+        most_important_feature = feature_names[feature_idx]
         
         # Split by median of most important feature
         feature_values = X_test[:, feature_idx]
@@ -188,17 +284,8 @@ def run_ensemble_analysis(csv_path, meta_learner="linear"):
         low_mask = feature_values <= median_val
         
         # Count wins in each scenario
-        linear_high = np.sum((linear_errors <= rf_errors) & (linear_errors <= xgb_errors) & high_mask)
-        rf_high = np.sum((rf_errors < linear_errors) & (rf_errors <= xgb_errors) & high_mask)
-        xgb_high = np.sum((xgb_errors < linear_errors) & (xgb_errors < rf_errors) & high_mask)
-        
-        linear_low = np.sum((linear_errors <= rf_errors) & (linear_errors <= xgb_errors) & low_mask)
-        rf_low = np.sum((rf_errors < linear_errors) & (rf_errors <= xgb_errors) & low_mask)
-        xgb_low = np.sum((xgb_errors < linear_errors) & (xgb_errors < rf_errors) & low_mask)
-        
-        # Determine winners
-        high_wins = {'linear': int(linear_high), 'rf': int(rf_high), 'xgb': int(xgb_high)}
-        low_wins = {'linear': int(linear_low), 'rf': int(rf_low), 'xgb': int(xgb_low)}
+        high_wins = dict(zip(EXPERT_NAMES, np.bincount(winners[high_mask], minlength=3).tolist()))
+        low_wins = dict(zip(EXPERT_NAMES, np.bincount(winners[low_mask], minlength=3).tolist()))
         
         best_high = max(high_wins, key=high_wins.get)
         best_low = max(low_wins, key=low_wins.get)
@@ -208,154 +295,84 @@ def run_ensemble_analysis(csv_path, meta_learner="linear"):
             'median_value': float(median_val),
             'high_scenario': {
                 'condition': f'> {median_val:.2f}',
-                'best_expert': {'linear': 'Linear Regression', 'rf': 'Random Forest', 'xgb': 'XGBoost'}[best_high],
+                'best_expert': EXPERT_NAMES[best_high],
                 'wins': high_wins
             },
             'low_scenario': {
                 'condition': f'≤ {median_val:.2f}',
-                'best_expert': {'linear': 'Linear Regression', 'rf': 'Random Forest', 'xgb': 'XGBoost'}[best_low],
+                'best_expert': EXPERT_NAMES[best_low],
                 'wins': low_wins
             }
         }
         
-        print(f"High {most_important_feature}: {feature_insights['high_scenario']['best_expert']} wins most")
-        print(f"Low {most_important_feature}: {feature_insights['low_scenario']['best_expert']} wins most")
-    
-    # Cross-validation for reliable scores
-    print("Running cross-validation (testing 5 times for reliability)...")
-    try:
-        # 5-fold cross-validation
-        voting_cv_scores = cross_val_score(
-            VotingRegressor([
-                ('linear', LinearRegression()),
-                ('rf', RandomForestRegressor(n_estimators=100, random_state=42, max_depth=10)),
-                ('xgb', GradientBoostingRegressor(n_estimators=100, random_state=42, max_depth=5))
-            ]),
-            X_train, y_train, cv=5, scoring='r2'
-        )
-        
-        stacking_cv_scores = cross_val_score(
-            StackingRegressor(
-                estimators=[
-                    ('linear', LinearRegression()),
-                    ('rf', RandomForestRegressor(n_estimators=100, random_state=42, max_depth=10)),
-                    ('xgb', GradientBoostingRegressor(n_estimators=100, random_state=42, max_depth=5))
-                ],
-                final_estimator=final_estimator
-            ),
-            X_train, y_train, cv=5, scoring='r2'
-        )
-        
-        # Calculate statistics
-        voting_cv_mean = float(np.mean(voting_cv_scores))
-        voting_cv_std = float(np.std(voting_cv_scores))
-        stacking_cv_mean = float(np.mean(stacking_cv_scores))
-        stacking_cv_std = float(np.std(stacking_cv_scores))
-        
-        # Statistical significance test
-        t_stat, p_value = stats.ttest_rel(stacking_cv_scores, voting_cv_scores)
-        is_significant = p_value < 0.05
-        
-        cross_validation = {
-            'voting': {
-                'mean_r2': voting_cv_mean,
-                'std_r2': voting_cv_std,
-                'confidence_95': [float(voting_cv_mean - 1.96*voting_cv_std), float(voting_cv_mean + 1.96*voting_cv_std)],
-                'all_scores': [float(s) for s in voting_cv_scores]
-            },
-            'stacking': {
-                'mean_r2': stacking_cv_mean,
-                'std_r2': stacking_cv_std,
-                'confidence_95': [float(stacking_cv_mean - 1.96*stacking_cv_std), float(stacking_cv_mean + 1.96*stacking_cv_std)],
-                'all_scores': [float(s) for s in stacking_cv_scores]
-            },
-            'statistical_test': {
-                'p_value': float(p_value),
-                'is_significant': bool(is_significant),
-                'confidence_level': '95%'
-            }
-        }
-        
-        print(f"Voting CV: {voting_cv_mean:.4f} ± {voting_cv_std:.4f}")
-        print(f"Stacking CV: {stacking_cv_mean:.4f} ± {stacking_cv_std:.4f}")
-        print(f"Statistically significant: {is_significant} (p={p_value:.4f})")
-        
-    except Exception as e:
-        print(f"Cross-validation failed: {e}")
-        cross_validation = None
-    
-    # Get sample predictions (first 10 from test set)
-    sample_indices = np.random.choice(len(X_test), min(10, len(X_test)), replace=False)
+        log(f"High {most_important_feature}: {feature_insights['high_scenario']['best_expert']} wins most")
+        log(f"Low {most_important_feature}: {feature_insights['low_scenario']['best_expert']} wins most")
+    
+    # Cross-validation on one shared 5-fold split: the base models are fit
+    # once per fold, and voting and every stacking meta-learner are scored
+    # on those fold predictions. The held-out fold predictions are also the
+    # out-of-fold stacking features for the full training set (same split
+    # StackingRegressor uses). Each fold's meta-learners are trained on
+    # features from an inner split of that fold's training rows only, as a
+    # StackingRegressor cross-validated with cross_val_score would be, so
+    # the held-out fold never leaks into them.
+    log("Running cross-validation (testing 5 times for reliability)...")
+    cv_folds = []
+    voting_cv_scores = []
+    Z_train = np.empty((len(X_train), 3))
+    for train_idx, val_idx in KFold(n_splits=5).split(X_train):
+        X_fold, X32_fold, y_fold = X_train[train_idx], X_train32[train_idx], y_train[train_idx]
+        fold_preds = np.column_stack([
+            model.fit(base_features(name, X_fold, X32_fold), y_fold)
+                 .predict(base_features(name, X_train, X_train32)[val_idx])
+            for name, model in fresh_base_estimators(n_jobs)
+        ])
+        Z_train[val_idx] = fold_preds
+        # VotingRegressor averages its estimators' predictions
+        voting_cv_scores.append(r2_score(y_train[val_idx], fold_preds.mean(axis=1)))
+        cv_folds.append((oof_base_predictions(X_fold, X32_fold, y_fold, n_jobs), y_fold, val_idx, fold_preds))
+    
+    voting_cv_scores = np.array(voting_cv_scores)
+    voting_cv_mean = float(np.mean(voting_cv_scores))
+    voting_cv_std = float(np.std(voting_cv_scores))
+    log(f"Voting CV: {voting_cv_mean:.4f} ± {voting_cv_std:.4f}")
+    
+    # Get sample predictions (10 seeded random test points, the same on every run)
+    sample_indices = np.random.default_rng(42).choice(len(X_test), size=min(10, len(X_test)),
+                                                      replace=False, shuffle=False)
     
     # Voting predictions sample
-    voting_predictions_sample = []
-    for idx in sample_indices:
-        voting_predictions_sample.append({
-            'actual': float(y_test.iloc[idx] if hasattr(y_test, 'iloc') else y_test[idx]),
-            'predicted': float(voting_pred[idx]),
-            'linear_reg': float(linear_pred[idx]),
-            'random_forest': float(rf_pred[idx]),
-            'xgboost': float(xgb_pred[idx])
-        })
-    
-    # Stacking predictions sample
-    stacking_predictions_sample = []
-    for idx in sample_indices:
-        stacking_predictions_sample.append({
-            'actual': float(y_test.iloc[idx] if hasattr(y_test, 'iloc') else y_test[idx]),
-            'predicted': float(stacking_pred[idx]),
-            'linear_reg': float(linear_pred[idx]),
-            'random_forest': float(rf_pred[idx]),
-            'xgboost': float(xgb_pred[idx])
-        })
+    voting_predictions_sample = predictions_sample(sample_indices, y_test, voting_pred, base_preds)
     
     # Prepare results
     best_base_r2 = max(linear_r2, rf_r2, xgb_r2)
     voting_improvement = ((voting_r2 - best_base_r2) / best_base_r2 * 100) if best_base_r2 > 0 else 0
-    stacking_improvement = ((stacking_r2 - best_base_r2) / best_base_r2 * 100) if best_base_r2 > 0 else 0
-    
-    # Format improvement strings with appropriate precision
-    def format_improvement(improvement):
-        if abs(improvement) < 0.1:
-            return f"<0.1%" if improvement >= 0 else f">-0.1%"
-        else:
-            return f"{improvement:.1f}%"
     
     voting_improvement_str = format_improvement(voting_improvement)
-    stacking_improvement_str = format_improvement(stacking_improvement)
-    
-    # Performance summary
-    print(f"\n===== PERFORMANCE COMPARISON =====")
-    print(f"Linear Regression R²: {linear_r2:.6f}")
-    print(f"Random Forest R²:     {rf_r2:.6f}")
-    print(f"XGBoost R²:           {xgb_r2:.6f}")
-    print(f"Best Base Model R²:   {best_base_r2:.6f}")
-    print(f"----------------------------------")
-    print(f"Voting R²:            {voting_r2:.6f} ({voting_improvement:+.2f}%)")
-    print(f"Stacking R²:          {stacking_r2:.6f} ({stacking_improvement:+.2f}%)")
-    print(f"===================================\n")
+    
+    base_models = {
+        'Linear Regression': {
+            'r2_score': float(linear_r2),
+            'rmse': float(linear_rmse),
+            'mae': float(linear_mae)
+        },
+        'Random Forest': {
+            'r2_score': float(rf_r2),
+            'rmse': float(rf_rmse),
+            'mae': float(rf_mae)
+        },
+        'XGBoost': {
+            'r2_score': float(xgb_r2),
+            'rmse': float(xgb_rmse),
+            'mae': float(xgb_mae)
+        }
+    }
     
     results = {
         'voting': {
             'algorithm': 'Voting Regressor',
             'voting_strategy': 'average',
-            'base_models': {
-                'Linear Regression': {
-                    'r2_score': float(linear_r2),
-                    'rmse': float(linear_rmse),
-                    'mae': float(linear_mae)
-                },
-                'Random Forest': {
-                    'r2_score': float(rf_r2),
-                    'rmse': float(rf_rmse),
-                    'mae': float(rf_mae)
-                },
-                'XGBoost': {
-                    'r2_score': float(xgb_r2),
-                    'rmse': float(xgb_rmse),
-                    'mae': float(xgb_mae)
-                }
-            },
+            'base_models': base_models,
             'ensemble_performance': {
                 'r2_score': float(voting_r2),
                 'rmse': float(voting_rmse),
@@ -366,26 +383,112 @@ def run_ensemble_analysis(csv_path, meta_learner="linear"):
             'feature_importance': feature_importance,
             'predictions_sample': voting_predictions_sample
         },
-        'stacking': {
-            'algorithm': 'Stacking Regressor',
-            'meta_learner': meta_learner_name,
-            'base_models': {
-                'Linear Regression': {
-                    'r2_score': float(linear_r2),
-                    'rmse': float(linear_rmse),
-                    'mae': float(linear_mae)
+        'stacking': {},
+        'dataset_info': {
+            'dataset_id': dataset_id,
+            'n_samples': data['n_samples'],
+            'n_features': data['n_features'],
+            'feature_names': feature_names,
+            'is_classification': False,
+            'task_type': 'regression',
+            'target_variable': target_variable,
+            'train_size': len(X_train),
+            'test_size': len(X_test)
+        }
+    }
+    
+    # Stacking features for the test set are the full-train base predictions
+    Z_test = base_preds
+    
+    # Only the stacking final estimator differs between meta-learners
+    for meta_learner in meta_learners:
+        log(f"Training Stacking Regressor with {meta_learner} meta-learner...")
+        final_estimator, meta_learner_name = select_meta_learner(meta_learner, n_jobs=n_jobs)
+        
+        final_estimator.fit(Z_train, y_train)
+        stacking_pred = final_estimator.predict(Z_test)
+        stacking_r2 = r2_score(y_test, stacking_pred)
+        stacking_rmse = np.sqrt(mean_squared_error(y_test, stacking_pred))
+        stacking_mae = mean_absolute_error(y_test, stacking_pred)
+        
+        # Extract meta-learner weights (if linear regression)
+        meta_weights = None
+        if isinstance(final_estimator, LinearRegression):
+            try:
+                weights = np.asarray(final_estimator.coef_, dtype=float)[:3]
+                # Normalize to percentages
+                total = np.abs(weights).sum()
+                if total > 0:
+                    weights = np.abs(weights) / total
+                meta_weights = dict(zip(EXPERT_NAMES, weights.tolist()))
+            except Exception as e:
+                log(f"Could not extract weights: {e}")
+        
+        # Cross-validation for reliable scores
+        cross_validation = None
+        try:
+            # Only the meta-learner is refit per fold; the fold's base
+            # predictions and inner out-of-fold features are shared
+            stacking_cv_scores = np.array([
+                r2_score(y_train[val_idx], clone(final_estimator).fit(Z_fold, y_fold).predict(fold_preds))
+                for Z_fold, y_fold, val_idx, fold_preds in cv_folds
+            ])
+            
+            # Calculate statistics
+            stacking_cv_mean = float(np.mean(stacking_cv_scores))
+            stacking_cv_std = float(np.std(stacking_cv_scores))
+            
+            # Statistical significance test
+            t_stat, p_value = paired_ttest(stacking_cv_scores, voting_cv_scores)
+            is_significant = p_value < 0.05
+            
+            cross_validation = {
+                'voting': {
+                    'mean_r2': voting_cv_mean,
+                    'std_r2': voting_cv_std,
+                    'confidence_95': [float(voting_cv_mean - 1.96*voting_cv_std), float(voting_cv_mean + 1.96*voting_cv_std)],
+                    'all_scores': [float(s) for s in voting_cv_scores]
                 },
-                'Random Forest': {
-                    'r2_score': float(rf_r2),
-                    'rmse': float(rf_rmse),
-                    'mae': float(rf_mae)
+                'stacking': {
+                    'mean_r2': stacking_cv_mean,
+                    'std_r2': stacking_cv_std,
+                    'confidence_95': [float(stacking_cv_mean - 1.96*stacking_cv_std), float(stacking_cv_mean + 1.96*stacking_cv_std)],
+                    'all_scores': [float(s) for s in stacking_cv_scores]
                 },
-                'XGBoost': {
-                    'r2_score': float(xgb_r2),
-                    'rmse': float(xgb_rmse),
-                    'mae': float(xgb_mae)
+                'statistical_test': {
+                    'p_value': float(p_value),
+                    'is_significant': bool(is_significant),
+                    'confidence_level': '95%'
                 }
-            },
+            }
+            
+            log(f"Stacking CV: {stacking_cv_mean:.4f} ± {stacking_cv_std:.4f}")
+            log(f"Statistically significant: {is_significant} (p={p_value:.4f})")
+            
+        except Exception as e:
+            log(f"Cross-validation failed: {e}")
+        
+        # Stacking predictions sample
+        stacking_predictions_sample = predictions_sample(sample_indices, y_test, stacking_pred, base_preds)
+        
+        stacking_improvement = ((stacking_r2 - best_base_r2) / best_base_r2 * 100) if best_base_r2 > 0 else 0
+        stacking_improvement_str = format_improvement(stacking_improvement)
+        
+        # Performance summary
+        log(f"\n===== PERFORMANCE COMPARISON ({meta_learner_name}) =====")
+        log(f"Linear Regression R²: {linear_r2:.6f}")
+        log(f"Random Forest R²:     {rf_r2:.6f}")
+        log(f"XGBoost R²:           {xgb_r2:.6f}")
+        log(f"Best Base Model R²:   {best_base_r2:.6f}")
+        log(f"----------------------------------")
+        log(f"Voting R²:            {voting_r2:.6f} ({voting_improvement:+.2f}%)")
+        log(f"Stacking R²:          {stacking_r2:.6f} ({stacking_improvement:+.2f}%)")
+        log(f"===================================\n")
+        
+        results['stacking'][meta_learner] = {
+            'algorithm': 'Stacking Regressor',
+            'meta_learner': meta_learner_name,
+            'base_models': base_models,
             'meta_model_performance': {
                 'r2_score': float(stacking_r2),
                 'rmse': float(stacking_rmse),
@@ -400,23 +503,12 @@ def run_ensemble_analysis(csv_path, meta_learner="linear"):
             'predictions_sample': stacking_predictions_sample,
             'feature_insights': feature_insights,
             'cross_validation': cross_validation
-        },
-        'dataset_info': {
-            'dataset_id': dataset_id,
-            'n_samples': data['n_samples'],
-            'n_features': data['n_features'],
-            'feature_names': feature_names,
-            'is_classification': False,
-            'task_type': 'regression',
-            'target_variable': target_variable,
-            'train_size': len(X_train),
-            'test_size': len(X_test)
         }
-    }
+        
+        log(f"Stacking ({meta_learner_name}) R²: {stacking_r2:.4f}, RMSE: {stacking_rmse:.4f}")
     
-    print("Ensemble analysis complete!")
-    print(f"Voting R²: {voting_r2:.4f}, RMSE: {voting_rmse:.4f}")
-    print(f"Stacking R²: {stacking_r2:.4f}, RMSE: {stacking_rmse:.4f}")
+    log("Ensemble analysis complete!")
+    log(f"Voting R²: {voting_r2:.4f}, RMSE: {voting_rmse:.4f}")
     
     return results
 
@@ -427,7 +519,11 @@ if __name__ == '__main__':
     
     csv_path = sys.argv[1]
     meta_learner = sys.argv[2] if len(sys.argv) > 2 else "linear"
-    results = run_ensemble_analysis(csv_path, meta_learner)
+    try:
+        results = run_ensemble_analysis(csv_path, meta_learner)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
     
     # Output results as JSON
     print("\n" + "="*50)
@@ -4,13 +4,17 @@ Main script to run ensemble ML algorithm analysis (Voting and Stacking)
 import sys
 import json
 import os
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ml_engine'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from ml_engine.preprocessing.data_processor import load_and_preprocess_csv
 from ml_engine.ensemble.ensemble_voting import train_voting_classifier
 from ml_engine.ensemble.ensemble_stacking import train_stacking_classifier
 
-def run_ensemble_analysis(csv_path, method='both', config=None):
+def _quiet(*args, **kwargs):
+    """Drop progress output when running as a library call"""
+    pass
+
+def run_ensemble_analysis(csv_path, method='both', config=None, verbose=True):
     """
     Run ensemble ML algorithm analysis on CSV data
     
@@ -18,6 +22,7 @@ def run_ensemble_analysis(csv_path, method='both', config=None):
         csv_path: Path to CSV file
         method: Ensemble method ('voting', 'stacking', or 'both')
         config: Configuration dictionary
+        verbose: Print progress messages (disable when called in-process)
     
     Returns:
         Dictionary containing results
@@ -25,14 +30,48 @@ def run_ensemble_analysis(csv_path, method='both', config=None):
     if config is None:
         config = {}
     
-    print(f"Starting Ensemble ML analysis with method: {method}")
-    print(f"Loading data from: {csv_path}")
+    log = print if verbose else _quiet
+    log(f"Starting Ensemble ML analysis with method: {method}")
+    
+    meta_learner = config.get('meta_learner', 'logistic')
+    meta_learners = [meta_learner] if method in ['stacking', 'both'] else []
+    results = run_ensemble_sweep(
+        csv_path, meta_learners, config,
+        include_voting=method in ['voting', 'both'],
+        verbose=verbose
+    )
+    
+    if 'stacking' in results:
+        results['stacking'] = results['stacking'][meta_learner]
+    return results
+
+def run_ensemble_sweep(csv_path, meta_learners, config=None, include_voting=True, verbose=True):
+    """
+    Run voting and stacking for several meta-learners on a single data load
+    
+    Args:
+        csv_path: Path to CSV file
+        meta_learners: List of stacking meta-learners to evaluate
+        config: Configuration dictionary (test_size, random_state,
+            voting_strategy, n_jobs, use_cache)
+        include_voting: Also train the Voting Classifier
+        verbose: Print progress messages (disable when called in-process)
+    
+    Returns:
+        Dictionary containing results, with 'stacking' keyed by meta-learner
+    """
+    if config is None:
+        config = {}
+    log = print if verbose else _quiet
+    
+    log(f"Loading data from: {csv_path}")
     
     # Load and preprocess data
     data = load_and_preprocess_csv(
         csv_path,
         test_size=config.get('test_size', 0.3),
-        random_state=config.get('random_state', 42)
+        random_state=config.get('random_state', 42),
+        use_cache=config.get('use_cache', True)
     )
     
     # Check if it's a classification task
@@ -55,29 +94,34 @@ def run_ensemble_analysis(csv_path, method='both', config=None):
     }
     
     # Run requested ensemble methods
-    if method in ['voting', 'both']:
-        print(f"Running Voting Classifier...")
+    if include_voting:
+        log(f"Running Voting Classifier...")
         voting_strategy = config.get('voting_strategy', 'soft')
         voting_results = train_voting_classifier(
             data['X_train'], data['X_test'],
             data['y_train'], data['y_test'],
             data['feature_names'],
-            voting=voting_strategy
+            voting=voting_strategy,
+            n_jobs=config.get('n_jobs', -1),
+            use_cache=config.get('use_cache', True)
         )
         results['voting'] = voting_results
     
-    if method in ['stacking', 'both']:
-        print(f"Running Stacking Classifier...")
-        meta_learner = config.get('meta_learner', 'logistic')
+    if meta_learners:
+        results['stacking'] = {}
+    for meta_learner in meta_learners:
+        log(f"Running Stacking Classifier ({meta_learner})...")
         stacking_results = train_stacking_classifier(
             data['X_train'], data['X_test'],
             data['y_train'], data['y_test'],
             data['feature_names'],
-            meta_learner=meta_learner
+            meta_learner=meta_learner,
+            n_jobs=config.get('n_jobs', -1),
+            use_cache=config.get('use_cache', True)
         )
-        results['stacking'] = stacking_results
+        results['stacking'][meta_learner] = stacking_results
     
-    print(f"Ensemble analysis complete!")
+    log(f"Ensemble analysis complete!")
     return results
 
 if __name__ == '__main__':
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Long-lived ML worker used by precompute_results.py --subprocess.
+
+numpy, pandas and sklearn are imported once at startup. The worker then reads
+one JSON job per line from stdin:
+
+    {"csv_path": "...", "classification": false, "meta_learners": ["linear", ...], "n_jobs": 1}
+
+and answers each job on stdout with a 4-byte big-endian length followed by the
+UTF-8 JSON results. Progress prints from the ML code go to stderr so they never
+mix with the framed output.
+"""
+import sys
+import json
+import os
+from contextlib import redirect_stdout
+
+try:
+    import orjson
+except ImportError:  # Fall back to the standard library encoder
+    orjson = None
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from run_ensemble import run_ensemble_sweep as reg_sweep
+from run_ensemble_analysis import run_ensemble_sweep as cls_sweep
+
+def run_job(job):
+    """Run one sweep job and return its results dictionary"""
+    if job.get('classification'):
+        return cls_sweep(job['csv_path'], job['meta_learners'], {'n_jobs': job.get('n_jobs', 1)},
+                         verbose=False)
+    return reg_sweep(job['csv_path'], job['meta_learners'], verbose=False,
+                     n_jobs=job.get('n_jobs', 1))
+
+def encode(results):
+    """Serialise a results dictionary straight to UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(results, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(results).encode('utf-8')
+
+def main():
+    out = sys.stdout.buffer
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+
+        try:
+            with redirect_stdout(sys.stderr):
+                results = run_job(json.loads(line))
+        except Exception as e:
+            results = {'error': str(e)}
+
+        payload = encode(results)
+        out.write(len(payload).to_bytes(4, 'big') + payload)
+        out.flush()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Helpers shared by the voting and stacking classifiers
+Scoring, prediction samples, feature importances and figure encoding
+"""
+import numpy as np
+import matplotlib
+# Headless raster backend for every trainer, which all import this module;
+# figures only ever become PNGs
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from sklearn.metrics import precision_recall_fscore_support
+from io import BytesIO
+
+try:
+    from pybase64 import b64encode
+except ImportError:  # Fall back to the standard library encoder
+    from base64 import b64encode
+
+# Keys of each predictions_sample row, in column order
+SAMPLE_KEYS = ('actual', 'predicted', 'logistic_reg', 'random_forest', 'xgboost')
+
+def plot_to_base64(fig):
+    """
+    Convert matplotlib figure to base64 string
+    
+    Each figure sets its margins with subplots_adjust when it is created, so
+    this is a single render pass (bbox_inches='tight' would draw it twice).
+    """
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png', dpi=100, facecolor='#0a0a0a')
+    # getbuffer() exposes the PNG bytes without copying them out of the BytesIO
+    image_base64 = b64encode(buffer.getbuffer()).decode('ascii')
+    plt.close(fig)
+    return image_base64
+
+def classification_metrics(y_true, y_pred):
+    """Accuracy plus weighted precision/recall/F1 from a single scoring pass"""
+    precision, recall, f1, _ = precision_recall_fscore_support(y_true, y_pred, average='weighted', zero_division=0)
+    return {
+        'accuracy': float(np.mean(y_true == y_pred)),
+        'precision': precision,
+        'recall': recall,
+        'f1_score': f1
+    }
+
+def feature_importance(model, feature_names):
+    """Importances normalized to sum to one, keyed by feature name ({} if the model has none)"""
+    if not hasattr(model, 'feature_importances_'):
+        return {}
+    importances = model.feature_importances_
+    return dict(zip(feature_names, (importances / (importances.sum() or 1.0)).tolist()))
+
+def predict_from_proba(model, proba):
+    """Class predictions from an already computed predict_proba array"""
+    return model.classes_[np.argmax(proba, axis=1)]
+
+def predictions_sample(sample_indices, actual, predicted, logistic, rf, xgb_p):
+    """Sampled rows of actual labels and model probabilities, as percentages"""
+    # Index each column first so only the sampled rows are ever stacked
+    rows = (np.column_stack([column[sample_indices] for column in (actual, predicted, logistic, rf, xgb_p)])
+            * 100.0).tolist()
+    return [dict(zip(SAMPLE_KEYS, row)) for row in rows]
@@ -4,26 +4,29 @@ Uses Logistic Regression, Random Forest, and XGBoost as base models
 with a meta-learner on top
 """
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
+from matplotlib.colors import LinearSegmentedColormap
+from matplotlib.collections import PatchCollection
+from matplotlib.patches import Circle
 import seaborn as sns
-from sklearn.ensemble import RandomForestClassifier, StackingClassifier
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix
-import xgboost as xgb
-import base64
-from io import BytesIO
+from sklearn.model_selection import StratifiedKFold
+from sklearn.metrics import confusion_matrix
 
-def plot_to_base64(fig):
-    """Convert matplotlib figure to base64 string"""
-    buffer = BytesIO()
-    fig.savefig(buffer, format='png', dpi=100, bbox_inches='tight', facecolor='#0a0a0a')
-    buffer.seek(0)
-    image_base64 = base64.b64encode(buffer.read()).decode()
-    plt.close(fig)
-    return image_base64
+from .xgb_config import make_xgb_classifier
+from . import model_cache
+from . import common
 
-def train_stacking_classifier(X_train, X_test, y_train, y_test, feature_names, meta_learner='logistic'):
+# Confusion matrix palette matching the site theme (single-hue emerald/green gradient), built once
+CONFUSION_CMAP = LinearSegmentedColormap.from_list('custom_cm', ['#0f172a', '#064e3b', '#047857', '#059669', '#10b981', '#34d399'])
+
+def _stack_features(proba):
+    """Meta-features from predict_proba, dropping the redundant column for binary tasks"""
+    return proba[:, 1:] if proba.shape[1] == 2 else proba
+
+def train_stacking_classifier(X_train, X_test, y_train, y_test, feature_names, meta_learner='logistic', n_jobs=-1, use_cache=True):
     """
     Train a stacking classifier with Linear Regression, Random Forest, and XGBoost
     
@@ -32,6 +35,8 @@ def train_stacking_classifier(X_train, X_test, y_train, y_test, feature_names, m
         y_train, y_test: Training and test labels
         feature_names: List of feature names
         meta_learner: Type of meta-learner ('logistic' or 'random_forest')
+        n_jobs: Parallel jobs for base model training (-1 uses all cores)
+        use_cache: Reuse fitted models from the disk cache for repeated training data
     
     Returns:
         Dictionary containing metrics and visualizations
@@ -41,8 +46,8 @@ def train_stacking_classifier(X_train, X_test, y_train, y_test, feature_names, m
     # Define base estimators
     base_estimators = [
         ('logistic_regression', LogisticRegression(max_iter=1000, random_state=42)),
-        ('random_forest', RandomForestClassifier(n_estimators=100, random_state=42)),
-        ('xgboost', xgb.XGBClassifier(n_estimators=100, random_state=42, eval_metric='logloss'))
+        ('random_forest', RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=n_jobs)),
+        ('xgboost', make_xgb_classifier(n_estimators=100, n_jobs=n_jobs))
     ]
     
     # Define meta-learner
@@ -51,78 +56,54 @@ def train_stacking_classifier(X_train, X_test, y_train, y_test, feature_names, m
     elif meta_learner == 'random_forest':
         final_estimator = RandomForestClassifier(n_estimators=50, random_state=42)
     elif meta_learner == 'xgboost':
-        final_estimator = xgb.XGBClassifier(n_estimators=200, max_depth=4, random_state=42, eval_metric='logloss')
+        final_estimator = make_xgb_classifier(n_estimators=200, max_depth=4, n_jobs=n_jobs)
     else:
         # default to logistic if unknown
         final_estimator = LogisticRegression(max_iter=1000, random_state=42)
     
-    # Create stacking classifier
-    stacking_clf = StackingClassifier(
-        estimators=base_estimators,
-        final_estimator=final_estimator,
-        cv=5
-    )
-    
-    # Train individual models for comparison
+    # Train individual models, one after another since the forest and XGBoost
+    # already use n_jobs cores each. These are also the stacking base layer,
+    # exactly what StackingClassifier would refit on the full training set.
     print("[v0] Training base models...")
-    logistic_model = LogisticRegression(max_iter=1000, random_state=42)
-    rf_model = RandomForestClassifier(n_estimators=100, random_state=42)
-    xgb_model = xgb.XGBClassifier(n_estimators=100, random_state=42, eval_metric='logloss')
-    
-    logistic_model.fit(X_train, y_train)
-    rf_model.fit(X_train, y_train)
-    xgb_model.fit(X_train, y_train)
+    logistic_model, rf_model, xgb_model = (
+        model_cache.fit(clone(model), X_train, y_train, use_cache) for _, model in base_estimators
+    )
     
+    # Out-of-fold meta-features (what StackingClassifier(cv=5) builds
+    # internally), then fit the meta-learner on them. The splitter is built
+    # once and shared by all three models; each fold fit uses n_jobs cores.
     print("[v0] Training stacking classifier...")
-    stacking_clf.fit(X_train, y_train)
+    cv = StratifiedKFold(n_splits=5, shuffle=False)
+    Z_train = np.hstack([
+        _stack_features(model_cache.oof_predict_proba(clone(model), X_train, y_train, cv=cv,
+                                                      use_cache=use_cache))
+        for _, model in base_estimators
+    ])
+    final_estimator.fit(Z_train, y_train)
+    
+    # Make predictions: one predict_proba pass over X_test per model feeds the
+    # class predictions, the positive-class probabilities and the meta-features
+    logistic_full, rf_full, xgb_full = (m.predict_proba(X_test) for m in (logistic_model, rf_model, xgb_model))
+    Z_test = np.hstack([_stack_features(p) for p in (logistic_full, rf_full, xgb_full)])
+    stack_full = final_estimator.predict_proba(Z_test)
     
-    # Make predictions
-    logistic_pred = logistic_model.predict(X_test)
-    rf_pred = rf_model.predict(X_test)
-    xgb_pred = xgb_model.predict(X_test)
-    stacking_pred = stacking_clf.predict(X_test)
+    logistic_pred = common.predict_from_proba(logistic_model, logistic_full)
+    rf_pred = common.predict_from_proba(rf_model, rf_full)
+    xgb_pred = common.predict_from_proba(xgb_model, xgb_full)
+    stacking_pred = common.predict_from_proba(final_estimator, stack_full)
     # Probabilities for positive class (index 1 if available)
-    pos_idx = 1 if hasattr(logistic_model, 'predict_proba') and logistic_model.predict_proba(X_test).shape[1] > 1 else 0
-    def safe_proba(m):
-        try:
-            p = m.predict_proba(X_test)
-            return p[:, pos_idx]
-        except Exception:
-            return (m.predict(X_test) == 1).astype(float)
-    logistic_proba = safe_proba(logistic_model)
-    rf_proba = safe_proba(rf_model)
-    xgb_proba = safe_proba(xgb_model)
-    try:
-        stack_proba = stacking_clf.predict_proba(X_test)[:, pos_idx]
-    except Exception:
-        stack_proba = (stacking_pred == 1).astype(float)
+    pos_idx = 1 if len(logistic_model.classes_) > 1 else 0
+    logistic_proba = logistic_full[:, pos_idx]
+    rf_proba = rf_full[:, pos_idx]
+    xgb_proba = xgb_full[:, pos_idx]
+    stack_proba = stack_full[:, pos_idx]
     
     # Calculate metrics
     models_metrics = {
-        'Logistic Regression': {
-            'accuracy': accuracy_score(y_test, logistic_pred),
-            'precision': precision_score(y_test, logistic_pred, average='weighted', zero_division=0),
-            'recall': recall_score(y_test, logistic_pred, average='weighted', zero_division=0),
-            'f1_score': f1_score(y_test, logistic_pred, average='weighted', zero_division=0)
-        },
-        'Random Forest': {
-            'accuracy': accuracy_score(y_test, rf_pred),
-            'precision': precision_score(y_test, rf_pred, average='weighted', zero_division=0),
-            'recall': recall_score(y_test, rf_pred, average='weighted', zero_division=0),
-            'f1_score': f1_score(y_test, rf_pred, average='weighted', zero_division=0)
-        },
-        'XGBoost': {
-            'accuracy': accuracy_score(y_test, xgb_pred),
-            'precision': precision_score(y_test, xgb_pred, average='weighted', zero_division=0),
-            'recall': recall_score(y_test, xgb_pred, average='weighted', zero_division=0),
-            'f1_score': f1_score(y_test, xgb_pred, average='weighted', zero_division=0)
-        },
-        'Stacking Ensemble': {
-            'accuracy': accuracy_score(y_test, stacking_pred),
-            'precision': precision_score(y_test, stacking_pred, average='weighted', zero_division=0),
-            'recall': recall_score(y_test, stacking_pred, average='weighted', zero_division=0),
-            'f1_score': f1_score(y_test, stacking_pred, average='weighted', zero_division=0)
-        }
+        'Logistic Regression': common.classification_metrics(y_test, logistic_pred),
+        'Random Forest': common.classification_metrics(y_test, rf_pred),
+        'XGBoost': common.classification_metrics(y_test, xgb_pred),
+        'Stacking Ensemble': common.classification_metrics(y_test, stacking_pred)
     }
     
     # Create visualizations
@@ -130,6 +111,7 @@ def train_stacking_classifier(X_train, X_test, y_train, y_test, feature_names, m
     
     # 1. Model Comparison
     fig, ax = plt.subplots(figsize=(12, 6), facecolor='#0a0a0a')
+    fig.subplots_adjust(left=0.07, right=0.98, top=0.88, bottom=0.16)
     ax.set_facecolor('#0a0a0a')
     
     models = list(models_metrics.keys())
@@ -155,19 +137,15 @@ def train_stacking_classifier(X_train, X_test, y_train, y_test, feature_names, m
     ax.spines['top'].set_visible(False)
     ax.spines['right'].set_visible(False)
     
-    visualizations['comparison'] = plot_to_base64(fig)
+    visualizations['comparison'] = common.plot_to_base64(fig)
     
     # 2. Confusion Matrix
     fig, ax = plt.subplots(figsize=(6, 4), facecolor='#0a0a0a')
+    fig.subplots_adjust(left=0.14, right=0.96, top=0.8, bottom=0.2)
     cm = confusion_matrix(y_test, stacking_pred)
 
-    # Create custom color palette matching site theme (single-hue emerald/green gradient)
-    import matplotlib.colors as mcolors
-    colors = ['#0f172a', '#064e3b', '#047857', '#059669', '#10b981', '#34d399']
-    custom_cmap = mcolors.LinearSegmentedColormap.from_list('custom_cm', colors)
-
     # Create heatmap with improved styling
-    sns.heatmap(cm, annot=True, fmt='d', cmap=custom_cmap,
+    sns.heatmap(cm, annot=True, fmt='d', cmap=CONFUSION_CMAP,
                 ax=ax, cbar_kws={'label': 'Count', 'shrink': 0.8},
                 linewidths=1, linecolor='#1e293b', square=True,
                 annot_kws={'size': 12, 'weight': 'bold', 'color': 'white'})
@@ -198,10 +176,11 @@ def train_stacking_classifier(X_train, X_test, y_train, y_test, feature_names, m
     for spine in ax.spines.values():
         spine.set_visible(False)
     
-    visualizations['confusion_matrix'] = plot_to_base64(fig)
+    visualizations['confusion_matrix'] = common.plot_to_base64(fig)
     
     # 3. Stacking Architecture Diagram
     fig, ax = plt.subplots(figsize=(12, 8), facecolor='#0a0a0a')
+    fig.subplots_adjust(left=0, right=1, top=1, bottom=0)
     ax.set_facecolor('#0a0a0a')
     ax.axis('off')
     
@@ -211,22 +190,23 @@ def train_stacking_classifier(X_train, X_test, y_train, y_test, feature_names, m
     base_models = ['Logistic\nRegression', 'Random\nForest', 'XGBoost']
     base_x = [0.2, 0.5, 0.8]
     
-    for i, (x, model) in enumerate(zip(base_x, base_models)):
-        circle = plt.Circle((x, base_y), 0.08, color=['#3b82f6', '#10b981', '#f59e0b'][i], alpha=0.8)
-        ax.add_patch(circle)
-        ax.text(x, base_y, model, ha='center', va='center', fontsize=10, color='white', fontweight='bold')
-    
     # Meta-learner layer
     meta_y = 0.7
     meta_x = 0.5
-    circle = plt.Circle((meta_x, meta_y), 0.1, color='#ef4444', alpha=0.8)
-    ax.add_patch(circle)
+    
+    # All four nodes go in one PatchCollection rather than one patch each
+    nodes = [Circle((x, base_y), 0.08) for x in base_x] + [Circle((meta_x, meta_y), 0.1)]
+    node_colors = ['#3b82f6', '#10b981', '#f59e0b', '#ef4444']
+    ax.add_collection(PatchCollection(nodes, facecolors=node_colors, edgecolors=node_colors, alpha=0.8))
+    for x, model in zip(base_x, base_models):
+        ax.text(x, base_y, model, ha='center', va='center', fontsize=10, color='white', fontweight='bold')
     ax.text(meta_x, meta_y, f'Meta-Learner\n({meta_learner.title()})', ha='center', va='center', 
             fontsize=10, color='white', fontweight='bold')
     
-    # Draw connections
-    for x in base_x:
-        ax.plot([x, meta_x], [base_y + 0.08, meta_y - 0.1], 'w-', alpha=0.3, linewidth=2)
+    # Draw connections (2D inputs plot one line per column in a single call)
+    n_base = len(base_x)
+    ax.plot(np.array([base_x, [meta_x] * n_base]), np.array([[base_y + 0.08] * n_base, [meta_y - 0.1] * n_base]),
+            'w-', alpha=0.3, linewidth=2)
     
     # Labels
     ax.text(0.5, 0.15, 'Base Models Layer', ha='center', fontsize=12, color='white', fontweight='bold')
@@ -237,26 +217,16 @@ def train_stacking_classifier(X_train, X_test, y_train, y_test, feature_names, m
     ax.set_xlim(0, 1)
     ax.set_ylim(0, 1)
     
-    visualizations['architecture'] = plot_to_base64(fig)
+    visualizations['architecture'] = common.plot_to_base64(fig)
 
     # Feature importance from Random Forest (normalized)
-    feature_importance = dict(zip(feature_names, rf_model.feature_importances_)) if hasattr(rf_model, 'feature_importances_') else {}
-    if feature_importance:
-        total = sum(feature_importance.values()) or 1.0
-        feature_importance = {k: float(v/total) for k, v in feature_importance.items()}
+    feature_importance = common.feature_importance(rf_model, feature_names)
 
     # Build prediction samples (percentages)
     n_show = min(5, len(X_test))
-    sample_indices = np.random.choice(len(X_test), n_show, replace=False)
-    predictions_sample = []
-    for idx in sample_indices:
-        predictions_sample.append({
-            'actual': float(y_test[idx] * 100.0),
-            'predicted': float(stack_proba[idx] * 100.0),
-            'logistic_reg': float(logistic_proba[idx] * 100.0),
-            'random_forest': float(rf_proba[idx] * 100.0),
-            'xgboost': float(xgb_proba[idx] * 100.0)
-        })
+    # Generator.choice without shuffle samples in O(n_show) for large test sets
+    sample_indices = np.random.default_rng(42).choice(len(X_test), size=n_show, replace=False, shuffle=False)
+    predictions_sample = common.predictions_sample(sample_indices, y_test, stack_proba, logistic_proba, rf_proba, xgb_proba)
     
     # Calculate improvement over best base model
     ensemble_accuracy = models_metrics['Stacking Ensemble']['accuracy']
@@ -279,7 +249,7 @@ def train_stacking_classifier(X_train, X_test, y_train, y_test, feature_names, m
         'meta_learner': meta_learner,
         'n_base_models': 3,
         'base_models': ['Logistic Regression', 'Random Forest', 'XGBoost'],
-        'cv_folds': 5,
+        'cv_folds': cv.get_n_splits(),
         'confusion_counts': cm.tolist(),
         'feature_importance': feature_importance,
         'predictions_sample': predictions_sample,
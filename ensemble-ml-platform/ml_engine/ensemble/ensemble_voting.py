@@ -3,27 +3,23 @@ Voting Classifier Implementation
 Combines Linear Regression, Random Forest, and XGBoost with soft voting
 """
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
+from matplotlib.colors import LinearSegmentedColormap
 import seaborn as sns
 from sklearn.ensemble import RandomForestClassifier, VotingClassifier
 from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix, classification_report
-import xgboost as xgb
-import base64
-from io import BytesIO
-import json
+from sklearn.preprocessing import LabelEncoder
+from sklearn.utils import Bunch
+from sklearn.metrics import confusion_matrix
 
-def plot_to_base64(fig):
-    """Convert matplotlib figure to base64 string"""
-    buffer = BytesIO()
-    fig.savefig(buffer, format='png', dpi=100, bbox_inches='tight', facecolor='#0a0a0a')
-    buffer.seek(0)
-    image_base64 = base64.b64encode(buffer.read()).decode()
-    plt.close(fig)
-    return image_base64
+from .xgb_config import make_xgb_classifier
+from . import model_cache
+from . import common
 
-def train_voting_classifier(X_train, X_test, y_train, y_test, feature_names, voting='soft'):
+# Confusion matrix palette matching the site theme (single-hue cyan gradient), built once
+CONFUSION_CMAP = LinearSegmentedColormap.from_list('custom_cm', ['#0f172a', '#0e7490', '#0891b2', '#06b6d4', '#22d3ee', '#67e8f9'])
+
+def train_voting_classifier(X_train, X_test, y_train, y_test, feature_names, voting='soft', n_jobs=-1, use_cache=True):
     """
     Train a voting classifier with Linear Regression, Random Forest, and XGBoost
     
@@ -32,6 +28,8 @@ def train_voting_classifier(X_train, X_test, y_train, y_test, feature_names, vot
         y_train, y_test: Training and test labels
         feature_names: List of feature names
         voting: 'soft' or 'hard' voting strategy
+        n_jobs: Parallel jobs for base model training (-1 uses all cores)
+        use_cache: Reuse fitted models from the disk cache for repeated training data
     
     Returns:
         Dictionary containing metrics and visualizations
@@ -40,10 +38,12 @@ def train_voting_classifier(X_train, X_test, y_train, y_test, feature_names, vot
     
     # Define base estimators
     lr_model = LogisticRegression(max_iter=1000, random_state=42)
-    rf_model = RandomForestClassifier(n_estimators=100, random_state=42)
-    xgb_model = xgb.XGBClassifier(n_estimators=100, random_state=42, eval_metric='logloss')
+    rf_model = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=n_jobs)
+    xgb_model = make_xgb_classifier(n_estimators=100, n_jobs=n_jobs)
     
-    # Create voting classifier
+    # Create voting classifier. It is only used for prediction: its fitted
+    # state is installed from the base models below, so fit (and with it
+    # n_jobs) never runs.
     voting_clf = VotingClassifier(
         estimators=[
             ('logistic_regression', lr_model),
@@ -53,47 +53,49 @@ def train_voting_classifier(X_train, X_test, y_train, y_test, feature_names, vot
         voting=voting
     )
     
-    # Train individual models and voting classifier
+    # Train individual models and voting classifier. The fits run one after
+    # another: the forest and XGBoost already spread over n_jobs cores, and a
+    # pool over the models on top of that would oversubscribe them.
     print("[v0] Training individual models...")
-    lr_model.fit(X_train, y_train)
-    rf_model.fit(X_train, y_train)
-    xgb_model.fit(X_train, y_train)
+    lr_model, rf_model, xgb_model = (
+        model_cache.fit(model, X_train, y_train, use_cache) for model in [lr_model, rf_model, xgb_model]
+    )
     
+    # VotingClassifier.fit would refit clones of the same seeded models, so
+    # install the fitted ones instead. y_train is already label-encoded
+    # (0..n_classes-1), so le_ is the identity mapping fit() would apply.
     print("[v0] Training voting classifier...")
-    voting_clf.fit(X_train, y_train)
+    voting_clf.estimators_ = [lr_model, rf_model, xgb_model]
+    voting_clf.named_estimators_ = Bunch(**dict(zip(
+        [name for name, _ in voting_clf.estimators], voting_clf.estimators_)))
+    voting_clf.le_ = LabelEncoder().fit(y_train)
+    voting_clf.classes_ = voting_clf.le_.classes_
     
-    # Make predictions
-    lr_pred = lr_model.predict(X_test)
-    rf_pred = rf_model.predict(X_test)
-    xgb_pred = xgb_model.predict(X_test)
-    voting_pred = voting_clf.predict(X_test)
+    # Make predictions: one predict_proba pass over X_test per model, with
+    # class predictions and positive-class probabilities derived from it
+    lr_full, rf_full, xgb_full = (m.predict_proba(X_test) for m in voting_clf.estimators_)
+    lr_pred = common.predict_from_proba(lr_model, lr_full)
+    rf_pred = common.predict_from_proba(rf_model, rf_full)
+    xgb_pred = common.predict_from_proba(xgb_model, xgb_full)
+    pos_idx = 1 if len(lr_model.classes_) > 1 else 0
+    if voting == 'soft':
+        # Soft voting averages the base probabilities (unweighted)
+        voting_full = np.mean([lr_full, rf_full, xgb_full], axis=0)
+        voting_pred = voting_clf.classes_[np.argmax(voting_full, axis=1)]
+        voting_proba = voting_full[:, pos_idx]
+    else:
+        voting_pred = voting_clf.predict(X_test)
+        voting_proba = (voting_pred == 1).astype(float)
+    lr_proba = lr_full[:, pos_idx]
+    rf_proba = rf_full[:, pos_idx]
+    xgb_proba = xgb_full[:, pos_idx]
     
     # Calculate metrics for each model
     models_metrics = {
-        'Logistic Regression': {
-            'accuracy': accuracy_score(y_test, lr_pred),
-            'precision': precision_score(y_test, lr_pred, average='weighted', zero_division=0),
-            'recall': recall_score(y_test, lr_pred, average='weighted', zero_division=0),
-            'f1_score': f1_score(y_test, lr_pred, average='weighted', zero_division=0)
-        },
-        'Random Forest': {
-            'accuracy': accuracy_score(y_test, rf_pred),
-            'precision': precision_score(y_test, rf_pred, average='weighted', zero_division=0),
-            'recall': recall_score(y_test, rf_pred, average='weighted', zero_division=0),
-            'f1_score': f1_score(y_test, rf_pred, average='weighted', zero_division=0)
-        },
-        'XGBoost': {
-            'accuracy': accuracy_score(y_test, xgb_pred),
-            'precision': precision_score(y_test, xgb_pred, average='weighted', zero_division=0),
-            'recall': recall_score(y_test, xgb_pred, average='weighted', zero_division=0),
-            'f1_score': f1_score(y_test, xgb_pred, average='weighted', zero_division=0)
-        },
-        'Voting Ensemble': {
-            'accuracy': accuracy_score(y_test, voting_pred),
-            'precision': precision_score(y_test, voting_pred, average='weighted', zero_division=0),
-            'recall': recall_score(y_test, voting_pred, average='weighted', zero_division=0),
-            'f1_score': f1_score(y_test, voting_pred, average='weighted', zero_division=0)
-        }
+        'Logistic Regression': common.classification_metrics(y_test, lr_pred),
+        'Random Forest': common.classification_metrics(y_test, rf_pred),
+        'XGBoost': common.classification_metrics(y_test, xgb_pred),
+        'Voting Ensemble': common.classification_metrics(y_test, voting_pred)
     }
     
     # Create visualizations
@@ -101,6 +103,7 @@ def train_voting_classifier(X_train, X_test, y_train, y_test, feature_names, vot
     
     # 1. Model Comparison Bar Chart
     fig, ax = plt.subplots(figsize=(12, 6), facecolor='#0a0a0a')
+    fig.subplots_adjust(left=0.07, right=0.98, top=0.88, bottom=0.16)
     ax.set_facecolor('#0a0a0a')
     
     models = list(models_metrics.keys())
@@ -126,19 +129,15 @@ def train_voting_classifier(X_train, X_test, y_train, y_test, feature_names, vot
     ax.spines['top'].set_visible(False)
     ax.spines['right'].set_visible(False)
     
-    visualizations['comparison'] = plot_to_base64(fig)
+    visualizations['comparison'] = common.plot_to_base64(fig)
     
     # 2. Confusion Matrix for Voting Classifier
     fig, ax = plt.subplots(figsize=(6, 4), facecolor='#0a0a0a')
+    fig.subplots_adjust(left=0.14, right=0.96, top=0.8, bottom=0.2)
     cm = confusion_matrix(y_test, voting_pred)
 
-    # Create custom color palette matching site theme (single-hue cyan gradient)
-    import matplotlib.colors as mcolors
-    colors = ['#0f172a', '#0e7490', '#0891b2', '#06b6d4', '#22d3ee', '#67e8f9']
-    custom_cmap = mcolors.LinearSegmentedColormap.from_list('custom_cm', colors)
-
     # Create heatmap with improved styling
-    sns.heatmap(cm, annot=True, fmt='d', cmap=custom_cmap,
+    sns.heatmap(cm, annot=True, fmt='d', cmap=CONFUSION_CMAP,
                 ax=ax, cbar_kws={'label': 'Count', 'shrink': 0.8},
                 linewidths=1, linecolor='#1e293b', square=True,
                 annot_kws={'size': 12, 'weight': 'bold', 'color': 'white'})
@@ -169,19 +168,25 @@ def train_voting_classifier(X_train, X_test, y_train, y_test, feature_names, vot
     for spine in ax.spines.values():
         spine.set_visible(False)
     
-    visualizations['confusion_matrix'] = plot_to_base64(fig)
+    visualizations['confusion_matrix'] = common.plot_to_base64(fig)
     
     # 3. Feature Importance (from Random Forest)
     if hasattr(rf_model, 'feature_importances_'):
+        importances = rf_model.feature_importances_
+        # Top 10 features: argpartition picks them in O(n), then only those ten are sorted
+        top_k = min(10, len(importances))
+        indices = np.argpartition(-importances, top_k - 1)[:top_k]
+        indices = indices[np.argsort(-importances[indices], kind='stable')]
+        labels = [feature_names[i] if i < len(feature_names) else f'Feature {i}' for i in indices]
+        
         fig, ax = plt.subplots(figsize=(10, 6), facecolor='#0a0a0a')
+        # Leave room for the longest tick label (~0.7% of the width per character)
+        fig.subplots_adjust(left=min(0.5, 0.04 + 0.007 * max(map(len, labels))), right=0.97, top=0.88, bottom=0.1)
         ax.set_facecolor('#0a0a0a')
         
-        importances = rf_model.feature_importances_
-        indices = np.argsort(importances)[::-1][:10]  # Top 10 features
-        
         ax.barh(range(len(indices)), importances[indices], color='#3b82f6')
         ax.set_yticks(range(len(indices)))
-        ax.set_yticklabels([feature_names[i] if i < len(feature_names) else f'Feature {i}' for i in indices], color='white')
+        ax.set_yticklabels(labels, color='white')
         ax.set_xlabel('Importance', fontsize=12, color='white')
         ax.set_title('Feature Importance (Random Forest)', fontsize=14, fontweight='bold', color='white', pad=20)
         ax.tick_params(colors='white')
@@ -191,10 +196,11 @@ def train_voting_classifier(X_train, X_test, y_train, y_test, feature_names, vot
         ax.spines['right'].set_visible(False)
         ax.grid(True, alpha=0.2, axis='x', color='white')
         
-        visualizations['feature_importance'] = plot_to_base64(fig)
+        visualizations['feature_importance'] = common.plot_to_base64(fig)
     
     # 4. Voting Process Visualization
     fig, ax = plt.subplots(figsize=(12, 6), facecolor='#0a0a0a')
+    fig.subplots_adjust(left=0.07, right=0.97, top=0.88, bottom=0.1)
     ax.set_facecolor('#0a0a0a')
     
     # Show predictions for first 20 samples
@@ -202,60 +208,45 @@ def train_voting_classifier(X_train, X_test, y_train, y_test, feature_names, vot
     sample_indices = range(n_samples)
     
     # Create a stacked visualization showing individual predictions
-    predictions_df = pd.DataFrame({
-        'LR': lr_pred[:n_samples],
-        'RF': rf_pred[:n_samples],
-        'XGB': xgb_pred[:n_samples],
-        'Voting': voting_pred[:n_samples],
-        'True': y_test[:n_samples]
-    })
+    vote_rows = ['LR', 'RF', 'XGB', 'Voting', 'True']
+    votes = np.vstack([lr_pred[:n_samples], rf_pred[:n_samples], xgb_pred[:n_samples],
+                       voting_pred[:n_samples], y_test[:n_samples]])
     
-    # Plot as heatmap
-    sns.heatmap(predictions_df.T, annot=True, fmt='g', cmap='RdYlGn', ax=ax, 
-                cbar_kws={'label': 'Class'}, linewidths=0.5)
+    # Plot as heatmap; drawn directly since seaborn's DataFrame handling
+    # outweighs the rendering for a 5 x 20 grid
+    mesh = ax.pcolormesh(votes, cmap='RdYlGn', edgecolors='white', linewidth=0.5)
+    ax.set_xlim(0, votes.shape[1])
+    ax.set_ylim(votes.shape[0], 0)
+    cbar = fig.colorbar(mesh, ax=ax, label='Class')
+    cbar.outline.set_linewidth(0)
+    
+    # Annotate each cell, dark text on light cells as seaborn does
+    rgb = mesh.cmap(mesh.norm(votes))[..., :3]
+    rgb = np.where(rgb <= 0.03928, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    luminance = rgb @ np.array([0.2126, 0.7152, 0.0722])
+    for (row, col), value in np.ndenumerate(votes):
+        ax.text(col + 0.5, row + 0.5, f'{value:g}', ha='center', va='center',
+                color='.15' if luminance[row, col] > 0.408 else 'white')
+    ax.set_xticks(np.arange(votes.shape[1]) + 0.5, labels=range(votes.shape[1]))
+    ax.set_yticks(np.arange(votes.shape[0]) + 0.5, labels=vote_rows, rotation='vertical', va='center')
+    for spine in ax.spines.values():
+        spine.set_visible(False)
     ax.set_title(f'Voting Process Visualization (First {n_samples} Samples)', 
                  fontsize=14, fontweight='bold', color='white', pad=20)
     ax.set_xlabel('Sample Index', fontsize=12, color='white')
     ax.set_ylabel('Model', fontsize=12, color='white')
     ax.tick_params(colors='white')
     
-    visualizations['voting_process'] = plot_to_base64(fig)
+    visualizations['voting_process'] = common.plot_to_base64(fig)
     
     # Feature importance from Random Forest (normalized)
-    feature_importance = dict(zip(feature_names, rf_model.feature_importances_)) if hasattr(rf_model, 'feature_importances_') else {}
-    if feature_importance:
-        total = sum(feature_importance.values()) or 1.0
-        feature_importance = {k: float(v/total) for k, v in feature_importance.items()}
+    feature_importance = common.feature_importance(rf_model, feature_names)
 
     # Build prediction samples (percentages)
     n_show = min(10, len(X_test))
-    sample_indices = np.random.choice(len(X_test), n_show, replace=False)
-    predictions_sample = []
-    pos_idx = 1 if hasattr(lr_model, 'predict_proba') and lr_model.predict_proba(X_test).shape[1] > 1 else 0
-    
-    def safe_proba(m):
-        try:
-            p = m.predict_proba(X_test)
-            return p[:, pos_idx]
-        except Exception:
-            return (m.predict(X_test) == 1).astype(float)
-    
-    lr_proba = safe_proba(lr_model)
-    rf_proba = safe_proba(rf_model)
-    xgb_proba = safe_proba(xgb_model)
-    try:
-        voting_proba = voting_clf.predict_proba(X_test)[:, pos_idx]
-    except Exception:
-        voting_proba = (voting_pred == 1).astype(float)
-    
-    for idx in sample_indices:
-        predictions_sample.append({
-            'actual': float(y_test[idx] * 100.0),
-            'predicted': float(voting_proba[idx] * 100.0),
-            'logistic_reg': float(lr_proba[idx] * 100.0),
-            'random_forest': float(rf_proba[idx] * 100.0),
-            'xgboost': float(xgb_proba[idx] * 100.0)
-        })
+    # Generator.choice without shuffle samples in O(n_show) for large test sets
+    sample_indices = np.random.default_rng(42).choice(len(X_test), size=n_show, replace=False, shuffle=False)
+    predictions_sample = common.predictions_sample(sample_indices, y_test, voting_proba, lr_proba, rf_proba, xgb_proba)
     
     # Calculate improvement over best base model
     ensemble_accuracy = models_metrics['Voting Ensemble']['accuracy']
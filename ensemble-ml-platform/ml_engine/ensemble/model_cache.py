@@ -0,0 +1,73 @@
+"""
+Disk cache for fitted base models and their out-of-fold predictions
+Calls are keyed by joblib.hash of the estimator (all its parameters but n_jobs) and the training
+data, so fits made with different core budgets share entries
+"""
+import os
+from functools import lru_cache
+import sklearn
+import xgboost as xgb
+from joblib import Memory
+from sklearn.base import clone
+from sklearn.model_selection import cross_val_predict
+
+# One directory per library version pair, so pickles never outlive the code that wrote them
+CACHE_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), '.cache')
+CACHE_DIR = os.path.join(CACHE_ROOT, 'models', f"sklearn-{sklearn.__version__}-xgboost-{xgb.__version__}")
+
+@lru_cache(maxsize=1)
+def get_memory():
+    """joblib Memory on CACHE_DIR; a no-op cache when the directory is not writable"""
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        ignore_file = os.path.join(CACHE_ROOT, '.gitignore')
+        if not os.path.exists(ignore_file):
+            with open(ignore_file, 'w') as f:
+                f.write('*\n')
+    except OSError:
+        return Memory(None, verbose=0)
+    return Memory(CACHE_DIR, verbose=0)
+
+def _split_n_jobs(model):
+    """(estimator with n_jobs cleared for hashing, its n_jobs); models without n_jobs pass through"""
+    n_jobs = model.get_params(deep=False).get('n_jobs')
+    if n_jobs is None:
+        return model, None
+    return clone(model).set_params(n_jobs=None), n_jobs
+
+def _with_n_jobs(model, n_jobs):
+    """Give an estimator back the core budget that was left out of the cache key"""
+    return model if n_jobs is None else model.set_params(n_jobs=n_jobs)
+
+def _fit(model, X, y, n_jobs=None):
+    """Fit a model with n_jobs cores and return it"""
+    return _with_n_jobs(model, n_jobs).fit(X, y)
+
+def _oof_predict_proba(model, X, y, cv, n_jobs=None):
+    """Out-of-fold predict_proba; the folds run one after another, each fit using n_jobs cores"""
+    return cross_val_predict(_with_n_jobs(clone(model), n_jobs), X, y, cv=cv, method='predict_proba')
+
+def fit(model, X, y, use_cache=True):
+    """
+    Fit a model, loading the fitted copy from disk when the same fit ran before
+
+    Args:
+        model: Unfitted estimator (its n_jobs is used for the fit but not the key)
+        X, y: Training data
+        use_cache: Read and write the disk cache
+
+    Returns:
+        Fitted estimator
+    """
+    if not use_cache:
+        return _fit(model, X, y)
+    key_model, n_jobs = _split_n_jobs(model)
+    fitted = get_memory().cache(_fit, ignore=['n_jobs'])(key_model, X, y, n_jobs=n_jobs)
+    return _with_n_jobs(fitted, n_jobs)
+
+def oof_predict_proba(model, X, y, cv, use_cache=True):
+    """Out-of-fold predict_proba from cross_val_predict, cached like fit"""
+    if not use_cache:
+        return _oof_predict_proba(model, X, y, cv)
+    key_model, n_jobs = _split_n_jobs(model)
+    return get_memory().cache(_oof_predict_proba, ignore=['n_jobs'])(key_model, X, y, cv, n_jobs=n_jobs)
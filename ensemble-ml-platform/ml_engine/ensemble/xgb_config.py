@@ -0,0 +1,58 @@
+"""
+Shared XGBoost settings for the ensemble models
+Histogram tree building everywhere, on the GPU when one is available
+"""
+from functools import lru_cache
+import xgboost as xgb
+
+@lru_cache(maxsize=1)
+def xgb_device():
+    """Return 'cuda' if XGBoost was built with CUDA and a GPU is visible, else 'cpu'"""
+    if not xgb.build_info().get('USE_CUDA'):
+        return 'cpu'
+    try:
+        import cupy
+        return 'cuda' if cupy.cuda.runtime.getDeviceCount() > 0 else 'cpu'
+    except Exception:
+        return 'cpu'
+
+def make_xgb_classifier(n_jobs=-1, **params):
+    """
+    Build an XGBClassifier with the platform defaults
+
+    Args:
+        n_jobs: CPU threads for training
+        **params: Model hyperparameters (n_estimators, max_depth, ...)
+
+    Returns:
+        Unfitted XGBClassifier
+    """
+    return xgb.XGBClassifier(
+        random_state=42,
+        eval_metric='logloss',
+        tree_method='hist',
+        max_bin=256,
+        device=xgb_device(),
+        n_jobs=n_jobs,
+        **params
+    )
+
+def make_xgb_regressor(n_jobs=-1, **params):
+    """
+    Build an XGBRegressor with the platform defaults
+
+    Args:
+        n_jobs: CPU threads for training
+        **params: Model hyperparameters (n_estimators, max_depth, ...)
+
+    Returns:
+        Unfitted XGBRegressor
+    """
+    return xgb.XGBRegressor(
+        random_state=42,
+        tree_method='hist',
+        max_bin=256,
+        device=xgb_device(),
+        n_jobs=n_jobs,
+        **params
+    )
@@ -1,38 +1,159 @@
 """
 Data Processing Utilities for ML Algorithms
 """
+import os
+import hashlib
+import pickle
 import pandas as pd
 import numpy as np
+import sklearn
 from sklearn.preprocessing import LabelEncoder, StandardScaler
 from sklearn.model_selection import train_test_split
 import json
 
-def load_and_preprocess_csv(file_path, target_column=None, test_size=0.3, random_state=42):
+try:
+    import pyarrow  # noqa: F401 - enables pandas' multithreaded Arrow CSV parser
+    CSV_ENGINE = 'pyarrow'
+except ImportError:  # Fall back to the pandas C parser
+    CSV_ENGINE = 'c'
+
+CACHE_DIR_NAME = '.cache'
+
+# dtype of the scaled feature matrices handed to the models
+FEATURE_DTYPE = np.float32
+
+def read_csv(file_path, dtype=None):
+    """
+    Read a CSV into numpy-backed columns, with the Arrow parser when available
+    
+    Args:
+        file_path: Path to CSV file
+        dtype: Optional column dtypes, to skip type inference for known schemas
+    
+    Returns:
+        pandas DataFrame
+    """
+    if CSV_ENGINE == 'pyarrow':
+        try:
+            return pd.read_csv(file_path, engine='pyarrow', dtype=dtype)
+        except ValueError:
+            # Arrow is stricter about malformed rows; let the C parser handle them
+            pass
+    return pd.read_csv(file_path, dtype=dtype)
+
+def scale_features(X_train, X_test, feature_dtype=FEATURE_DTYPE):
+    """
+    Standardize features with the mean and standard deviation of the training set
+    
+    The scaled matrices are float32 by default: the tree models bin or cast
+    to float32 anyway, and half-width features halve the memory traffic of
+    every fit.
+    
+    Args:
+        X_train: Training feature matrix
+        X_test: Test feature matrix
+        feature_dtype: dtype of the scaled matrices
+    
+    Returns:
+        (X_train_scaled, X_test_scaled, fitted StandardScaler), the matrices as feature_dtype
+    """
+    scaler = StandardScaler()
+    return (scaler.fit_transform(X_train).astype(feature_dtype, copy=False),
+            scaler.transform(X_test).astype(feature_dtype, copy=False), scaler)
+
+def _cache_path(file_path, target_column, test_size, random_state, dtype=None, feature_dtype=FEATURE_DTYPE):
+    """
+    Cache file for one CSV and argument set
+    
+    The name changes whenever the CSV or this module is modified, and with the
+    pandas/numpy/sklearn versions, since the pickles hold a StandardScaler and
+    LabelEncoders that need not load under other versions.
+    """
+    stat = os.stat(file_path)
+    key = repr((os.path.abspath(file_path), target_column, test_size, random_state, dtype,
+                np.dtype(feature_dtype).str,
+                stat.st_mtime_ns, stat.st_size, os.stat(__file__).st_mtime_ns,
+                pd.__version__, np.__version__, sklearn.__version__))
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(file_path))[0].replace(' ', '_')
+    return os.path.join(os.path.dirname(os.path.abspath(file_path)), CACHE_DIR_NAME,
+                        f"{name}-{digest}.pkl")
+
+def _write_cache(cache_file, data):
+    """Best-effort cache write: a read-only data directory just means no caching"""
+    try:
+        cache_dir = os.path.dirname(cache_file)
+        os.makedirs(cache_dir, exist_ok=True)
+        ignore_file = os.path.join(cache_dir, '.gitignore')
+        if not os.path.exists(ignore_file):
+            with open(ignore_file, 'w') as f:
+                f.write('*\n')
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+
+def load_and_preprocess_csv(file_path, target_column=None, test_size=0.3, random_state=42, use_cache=True,
+                            dtype=None, feature_dtype=FEATURE_DTYPE):
     """
     Load CSV file and preprocess data for ML algorithms
     
+    The processed dictionary is pickled to a .cache directory next to the CSV,
+    keyed on the arguments, the file's modification time and the library
+    versions, so repeated runs skip parsing, encoding, splitting and scaling.
+    
     Args:
         file_path: Path to CSV file
         target_column: Name or index of target column (default: last column)
         test_size: Proportion of test set
         random_state: Random seed for reproducibility
+        use_cache: Read and write the on-disk cache
+        dtype: Optional column dtypes passed to the CSV reader
+        feature_dtype: dtype of the scaled X_train/X_test matrices
     
     Returns:
         Dictionary containing processed data and metadata
     """
+    if not use_cache:
+        return _preprocess_csv(file_path, target_column, test_size, random_state, dtype, feature_dtype)
+    
+    cache_file = _cache_path(file_path, target_column, test_size, random_state, dtype, feature_dtype)
+    try:
+        with open(cache_file, 'rb') as f:
+            data = pickle.load(f)
+        print(f"Loaded cached dataset: {data['n_samples']} rows, {data['n_features'] + 1} columns")
+        return data
+    except Exception:
+        # Missing, truncated or unloadable (e.g. written by other library
+        # versions): any failure is a cache miss and the CSV is parsed again
+        pass
+    
+    data = _preprocess_csv(file_path, target_column, test_size, random_state, dtype, feature_dtype)
+    _write_cache(cache_file, data)
+    return data
+
+def _preprocess_csv(file_path, target_column, test_size, random_state, dtype=None, feature_dtype=FEATURE_DTYPE):
+    """Parse, encode, split and scale a CSV file (uncached)"""
     # Load data
-    df = pd.read_csv(file_path)
+    df = read_csv(file_path, dtype=dtype)
     
     print(f"Loaded dataset: {df.shape[0]} rows, {df.shape[1]} columns")
     
-    # Handle missing values
-    if df.isnull().any().any():
+    # Handle missing values (one vectorized fill per column group)
+    missing = df.isnull().any().values
+    if missing.any():
         print(f"Found missing values, filling with median/mode")
-        for col in df.columns:
-            if df[col].dtype in ['float64', 'int64']:
-                df[col].fillna(df[col].median(), inplace=True)
-            else:
-                df[col].fillna(df[col].mode()[0], inplace=True)
+        # 'number' covers every width and the nullable Int/UInt/Float dtypes, not just float64/int64
+        numeric = df.columns.isin(df.select_dtypes(include='number').columns)
+        num_cols = df.columns[missing & numeric]
+        other_cols = df.columns[missing & ~numeric]
+        if len(num_cols):
+            # As float64 so that nullable integer columns can take a fractional median
+            df[num_cols] = df[num_cols].astype(np.float64).fillna(df[num_cols].median())
+        if len(other_cols):
+            df[other_cols] = df[other_cols].fillna(df[other_cols].mode().iloc[0])
     
     # Determine target column
     if target_column is None:
@@ -57,14 +178,17 @@ def load_and_preprocess_csv(file_path, target_column=None, test_size=0.3, random
     # Store original feature names
     feature_names = X.columns.tolist()
     
-    # Encode categorical features
+    # Encode categorical features. pd.Categorical hashes the values in C and
+    # sorts its categories, giving the same codes LabelEncoder would; the
+    # encoders are rebuilt from the categories so callers can still decode.
     label_encoders = {}
-    for col in X.columns:
-        if X[col].dtype == 'object':
-            print(f"Encoding categorical feature: {col}")
-            le = LabelEncoder()
-            X[col] = le.fit_transform(X[col].astype(str))
-            label_encoders[col] = le
+    for col in X.select_dtypes(include=['object']).columns:
+        print(f"Encoding categorical feature: {col}")
+        categorical = pd.Categorical(X[col].astype(str))
+        X[col] = categorical.codes.astype(np.int64)
+        le = LabelEncoder()
+        le.classes_ = np.asarray(categorical.categories, dtype=object)
+        label_encoders[col] = le
     
     # Encode target if categorical
     target_encoder = None
@@ -74,6 +198,8 @@ def load_and_preprocess_csv(file_path, target_column=None, test_size=0.3, random
         is_classification = True
         target_encoder = LabelEncoder()
         y = target_encoder.fit_transform(y.astype(str))
+        if len(target_encoder.classes_) < 128:
+            y = y.astype(np.int8)  # Class indices fit in one byte
         class_names = target_encoder.classes_.tolist()
     else:
         print(f"Detected regression task")
@@ -90,9 +216,7 @@ def load_and_preprocess_csv(file_path, target_column=None, test_size=0.3, random
     )
     
     # Scale features
-    scaler = StandardScaler()
-    X_train_scaled = scaler.fit_transform(X_train)
-    X_test_scaled = scaler.transform(X_test)
+    X_train_scaled, X_test_scaled, scaler = scale_features(X_train, X_test, feature_dtype)
     
     print(f"Train set: {X_train.shape[0]} samples")
     print(f"Test set: {X_test.shape[0]} samples")
@@ -137,7 +261,8 @@ def detect_optimal_clusters(X, max_clusters=10):
         inertias.append(kmeans.inertia_)
     
     # Simple elbow detection: find point with maximum curvature
-    if len(inertias) < 2:
+    # (a second derivative needs at least three points)
+    if len(inertias) < 3:
         return 3
     
     # Calculate second derivative
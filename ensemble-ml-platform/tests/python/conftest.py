@@ -0,0 +1,7 @@
+"""Put the project root and ml-scripts on sys.path, as the scripts themselves do"""
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(PROJECT_ROOT / 'ml-scripts'))
@@ -0,0 +1,59 @@
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from ml_engine.preprocessing.data_processor import CACHE_DIR_NAME, load_and_preprocess_csv
+
+DATA_DIR = Path(__file__).resolve().parents[2] / 'data'
+
+
+def assert_same_data(actual, expected):
+    assert actual.keys() == expected.keys()
+    for key, value in expected.items():
+        if isinstance(value, np.ndarray):
+            assert actual[key].dtype == value.dtype, key
+            np.testing.assert_array_equal(actual[key], value, err_msg=key)
+        elif isinstance(value, (str, int, float, bool, list, tuple, type(None))):
+            assert actual[key] == value, key
+
+
+@pytest.mark.parametrize('name', ['Automobile.csv', 'Concrete.csv', 'Loan Approval.csv'])
+def test_cache_hit_matches_cache_miss(tmp_path, name):
+    csv_path = tmp_path / name
+    shutil.copy(DATA_DIR / name, csv_path)
+    
+    uncached = load_and_preprocess_csv(str(csv_path), use_cache=False)
+    assert not (tmp_path / CACHE_DIR_NAME).exists()
+    
+    miss = load_and_preprocess_csv(str(csv_path))
+    assert len(list((tmp_path / CACHE_DIR_NAME).glob('*.pkl'))) == 1
+    hit = load_and_preprocess_csv(str(csv_path))
+    
+    assert_same_data(miss, uncached)
+    assert_same_data(hit, uncached)
+
+
+def test_unreadable_cache_is_a_miss(tmp_path):
+    csv_path = tmp_path / 'Concrete.csv'
+    shutil.copy(DATA_DIR / 'Concrete.csv', csv_path)
+    expected = load_and_preprocess_csv(str(csv_path))
+    
+    (cache_file,) = (tmp_path / CACHE_DIR_NAME).glob('*.pkl')
+    cache_file.write_bytes(b'not a pickle')
+    assert_same_data(load_and_preprocess_csv(str(csv_path)), expected)
+    assert os.path.getsize(cache_file) > len(b'not a pickle')
+
+
+def test_feature_dtype_is_cached_separately(tmp_path):
+    csv_path = tmp_path / 'Automobile.csv'
+    shutil.copy(DATA_DIR / 'Automobile.csv', csv_path)
+    
+    narrow = load_and_preprocess_csv(str(csv_path))
+    wide = load_and_preprocess_csv(str(csv_path), feature_dtype=np.float64)
+    assert narrow['X_train'].dtype == np.float32 and wide['X_train'].dtype == np.float64
+    assert len(list((tmp_path / CACHE_DIR_NAME).glob('*.pkl'))) == 2
+    assert load_and_preprocess_csv(str(csv_path), feature_dtype=np.float64)['X_train'].dtype == np.float64
+    np.testing.assert_array_equal(narrow['X_train'], wide['X_train'].astype(np.float32))
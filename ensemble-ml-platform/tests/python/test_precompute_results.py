@@ -0,0 +1,97 @@
+import json
+import multiprocessing
+import subprocess
+import sys
+import time
+
+import pytest
+from threadpoolctl import threadpool_info
+
+import precompute_results
+from precompute_results import read_result
+
+
+def spawn(script):
+    """A stand-in worker that runs script and writes to a stdout pipe"""
+    return subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE)
+
+
+def frame_script(*frames):
+    """Script writing each payload (bytes) as a length-prefixed frame"""
+    return ('import sys\n'
+            f'for payload in {list(frames)!r}:\n'
+            '    sys.stdout.buffer.write(len(payload).to_bytes(4, "big") + payload)\n'
+            'sys.stdout.flush()\n')
+
+
+def test_reads_consecutive_frames():
+    first = {'r2': 0.91, 'name': 'café'}
+    second = {'rows': list(range(1000))}
+    worker = spawn(frame_script(json.dumps(first).encode('utf-8'), json.dumps(second).encode('utf-8')))
+    assert read_result(worker) == first
+    assert read_result(worker) == second
+    assert worker.wait() == 0
+
+
+def test_truncated_header():
+    worker = spawn('import sys; sys.stdout.buffer.write(b"\\x00\\x00"); sys.exit(3)')
+    with pytest.raises(Exception, match='exited with code 3 before returning a result'):
+        read_result(worker)
+
+
+def test_truncated_payload():
+    worker = spawn('import sys; sys.stdout.buffer.write((100).to_bytes(4, "big") + b"{\\"a\\": 1"); sys.exit(4)')
+    with pytest.raises(Exception, match='exited with code 4 mid-result'):
+        read_result(worker)
+
+
+def test_timeout_kills_worker():
+    worker = spawn('import time; time.sleep(60)')
+    with pytest.raises(TimeoutError, match='within 0.5s'):
+        read_result(worker, timeout=0.5)
+    assert worker.wait(timeout=5) != 0
+
+
+def fake_analyze(dataset_id, n_jobs=1):
+    """Stand-in for analyze_dataset: 'hang' never finishes, 'fail' raises"""
+    if dataset_id == 'hang':
+        time.sleep(60)
+    if dataset_id == 'fail':
+        raise ValueError('bad data')
+    return [dataset_id]
+
+
+def pool_thread_counts(dataset_id, n_jobs=1):
+    """Stand-in for analyze_dataset reporting the process's OpenMP/BLAS pool sizes"""
+    return [(n_jobs, [info['num_threads'] for info in threadpool_info()])]
+
+
+needs_fork = pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                                reason="pool processes must inherit the patched analyze_dataset")
+
+
+@needs_fork
+def test_pool_times_out_each_job_and_keeps_going(monkeypatch):
+    monkeypatch.setattr(precompute_results, 'DATASETS', dict.fromkeys(['first', 'hang', 'fail', 'last'], ''))
+    monkeypatch.setattr(precompute_results, 'analyze_dataset', fake_analyze)
+    monkeypatch.setattr(precompute_results, 'JOB_TIMEOUT', 1)
+    
+    started = time.monotonic()
+    results = dict(precompute_results._run_in_pool(max_workers=1))
+    
+    assert time.monotonic() - started < 20
+    assert results['first'] == ['first'] and results['last'] == ['last']
+    assert isinstance(results['hang'], TimeoutError)
+    assert isinstance(results['fail'], ValueError)
+
+
+@needs_fork
+def test_pool_processes_limit_native_threads(monkeypatch):
+    monkeypatch.setattr(precompute_results, 'DATASETS', {'only': ''})
+    monkeypatch.setattr(precompute_results, 'analyze_dataset', pool_thread_counts)
+    monkeypatch.setattr(precompute_results, 'inner_jobs', lambda max_workers: 3)
+    
+    ((_, outputs),) = precompute_results._run_in_pool(max_workers=1)
+    ((n_jobs, thread_counts),) = outputs
+    assert n_jobs == 3
+    assert thread_counts and set(thread_counts) == {3}
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from scipy import stats
+
+from run_ensemble import paired_ttest
+
+
+@pytest.mark.parametrize('n', [2, 3, 5, 6, 10, 31])
+def test_paired_ttest_matches_scipy(n):
+    rng = np.random.default_rng(n)
+    a = rng.normal(size=n)
+    b = a + rng.normal(0.3, 1.0, size=n)
+    t, p = paired_ttest(a, b)
+    expected = stats.ttest_rel(a, b)
+    assert t == pytest.approx(expected.statistic, rel=1e-12)
+    assert p == pytest.approx(expected.pvalue, rel=1e-9, abs=1e-14)
+
+
+def test_paired_ttest_large_statistic():
+    a = np.array([0.91, 0.92, 0.93, 0.94, 0.95])
+    t, p = paired_ttest(a, a - np.array([0.10, 0.11, 0.10, 0.12, 0.11]))
+    expected = stats.ttest_rel(a, a - np.array([0.10, 0.11, 0.10, 0.12, 0.11]))
+    assert t == pytest.approx(expected.statistic, rel=1e-10)
+    assert p == pytest.approx(expected.pvalue, rel=1e-6, abs=1e-14)
+
+
+def test_paired_ttest_identical_scores_is_nan():
+    t, p = paired_ttest([0.5, 0.6, 0.7], [0.5, 0.6, 0.7])
+    assert np.isnan(t) and np.isnan(p)
@@ -0,0 +1,86 @@
+import copy
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+from joblib import Memory
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+
+import verify_results
+from ml_engine.ensemble import model_cache
+from precompute_results import file_sha256, inputs_sha256
+
+DATA_DIR = Path(__file__).resolve().parents[2] / 'data'
+LOAN_CONFIG = {'meta_learner': 'linear', 'voting_strategy': 'soft', 'random_state': 42}
+
+
+@pytest.fixture
+def isolated_caches(tmp_path, monkeypatch):
+    """Dataset, model and verification caches under tmp_path instead of the project"""
+    monkeypatch.setattr(verify_results, 'VERIFY_CACHE_DIR', tmp_path / 'verify')
+    memory = Memory(str(tmp_path / 'models'), verbose=0)
+    monkeypatch.setattr(model_cache, 'get_memory', lambda: memory)
+    return tmp_path
+
+
+def count_fits(monkeypatch, estimator_class):
+    """Patch estimator_class.fit to count its calls"""
+    calls = []
+    fit = estimator_class.fit
+    def counting_fit(self, *args, **kwargs):
+        calls.append(self)
+        return fit(self, *args, **kwargs)
+    monkeypatch.setattr(estimator_class, 'fit', counting_fit)
+    return calls
+
+
+@pytest.mark.parametrize('options', [{'use_cache': False}, {'force': True}])
+def test_fresh_loan_run_refits_models(isolated_caches, monkeypatch, capsys, options):
+    csv_path = isolated_caches / 'Loan Approval.csv'
+    shutil.copy(DATA_DIR / 'Loan Approval.csv', csv_path)
+    warm = verify_results.cached_run(csv_path, 'voting', LOAN_CONFIG, classification=True, n_jobs=1)
+    capsys.readouterr()
+    
+    fits = count_fits(monkeypatch, RandomForestClassifier)
+    fresh = verify_results.cached_run(csv_path, 'voting', LOAN_CONFIG, classification=True, n_jobs=1, **options)
+    
+    assert fits, "no Random Forest was refit"
+    assert 'Loaded cached dataset' not in capsys.readouterr().out
+    assert fresh['voting']['metrics'] == warm['voting']['metrics']
+
+
+def test_no_cache_regression_run_reparses_csv(isolated_caches, monkeypatch, capsys):
+    csv_path = isolated_caches / 'Concrete.csv'
+    shutil.copy(DATA_DIR / 'Concrete.csv', csv_path)
+    verify_results.cached_run(csv_path, 'linear', {}, classification=False, n_jobs=1)
+    capsys.readouterr()
+    
+    fits = count_fits(monkeypatch, RandomForestRegressor)
+    verify_results.cached_run(csv_path, 'linear', {}, classification=False, n_jobs=1, use_cache=False)
+    
+    assert fits
+    assert 'Loaded cached dataset' not in capsys.readouterr().out
+
+
+def test_recorded_inputs_skip_needs_unmodified_results(isolated_caches, monkeypatch):
+    results_file = isolated_caches / 'automobile-voting.json'
+    shutil.copy(verify_results.PRECOMP_DIR / results_file.name, results_file)
+    monkeypatch.setattr(verify_results, 'PRECOMP_DIR', isolated_caches)
+    results = json.loads(results_file.read_text())
+    runs = []
+    def fake_run(*args, **kwargs):
+        runs.append(args)
+        return {'voting': copy.deepcopy(results['data']['voting'])}
+    monkeypatch.setattr(verify_results, 'cached_run', fake_run)
+    recorded = (inputs_sha256(DATA_DIR / 'Automobile.csv'), file_sha256(results_file))
+    
+    assert verify_results.verify_dataset('automobile', 'Automobile.csv', recorded_inputs=recorded) == []
+    assert not runs
+    
+    edited = copy.deepcopy(results)
+    edited['data']['voting']['ensemble_performance']['r2_score'] += 0.5
+    results_file.write_text(json.dumps(edited))
+    issues = verify_results.verify_dataset('automobile', 'Automobile.csv', recorded_inputs=recorded)
+    assert runs
+    assert any('r2_score' in issue for issue in issues)
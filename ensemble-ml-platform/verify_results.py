@@ -3,105 +3,268 @@
 Verification script to test accuracy of precomputed results
 """
 import sys
+import os
+import io
 import json
+import hashlib
+import pickle
+import argparse
+import asyncio
+import traceback
+import joblib
 import numpy as np
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+
+try:
+    import orjson
+except ImportError:  # Fall back to ijson or the standard library decoder
+    orjson = None
+
+try:
+    import ijson  # Streaming parser; picks the C (yajl2_c) backend when available
+except ImportError:  # Fall back to parsing the whole file with json
+    ijson = None
 
 # Add script and engine paths
 PROJECT_ROOT = Path(__file__).parent
 SCRIPT_ROOT = PROJECT_ROOT / "ml-scripts"
 ENGINE_ROOT = PROJECT_ROOT / "ml_engine"
+VERIFY_CACHE_DIR = PROJECT_ROOT / ".verify_cache"
+DATA_DIR = PROJECT_ROOT / "data"
+PRECOMP_DIR = PROJECT_ROOT / "public" / "precomputed-results"
 
 sys.path.insert(0, str(SCRIPT_ROOT))
 sys.path.insert(0, str(ENGINE_ROOT))
 
 from run_ensemble import run_ensemble_analysis as run_regression_ensemble
 from run_ensemble_analysis import run_ensemble_analysis as run_classification_ensemble
+from precompute_results import file_sha256, inputs_sha256
 
-def compare_results(precomputed, fresh, dataset_name, method):
-    """Compare precomputed vs freshly computed results"""
-    print(f"\n{'='*60}")
-    print(f"Verifying: {dataset_name} - {method}")
-    print(f"{'='*60}")
+CLASSIFICATION_METRICS = ['accuracy', 'precision', 'recall', 'f1_score']
+REGRESSION_METRICS = ['r2_score', 'rmse', 'mae']
+TOLERANCE = 0.01  # Largest metric difference accepted between precomputed and fresh runs
+RANDOM_STATE = 42  # Seed the precomputed results were generated with
+REPRODUCED_TOLERANCE = 1e-12  # Differences below this are float rounding, not model changes
+
+# Per dataset: (compared metrics, voting key of the per-model table, voting key
+# of the ensemble's own metrics or None when the table already includes it)
+SPEC = {
+    'loan': (CLASSIFICATION_METRICS, 'metrics', None),
+    'default': (REGRESSION_METRICS, 'base_models', 'ensemble_performance'),
+}
+
+def metric_rows(voting, dataset_name):
+    """Flatten a voting results dict into {model_name: {metric: value}} for the compared metrics"""
+    metrics, table_key, ensemble_key = SPEC.get(dataset_name, SPEC['default'])
+    rows = {name: {metric: values[metric] for metric in metrics}
+            for name, values in voting[table_key].items()}
+    if ensemble_key:
+        rows['Ensemble'] = {metric: voting[ensemble_key][metric] for metric in metrics}
+    return rows
+
+def _ensure_cache_dir():
+    """Create VERIFY_CACHE_DIR with a .gitignore that keeps its contents out of git"""
+    VERIFY_CACHE_DIR.mkdir(exist_ok=True)
+    ignore_file = VERIFY_CACHE_DIR / '.gitignore'
+    if not ignore_file.exists():
+        ignore_file.write_text('*\n')
+
+def _parse_precomputed_rows(precomputed_file, dataset_name):
+    """
+    Parse the compared voting metrics out of a precomputed JSON file
+    
+    orjson decodes the whole file in one C pass and measured fastest. Without
+    it, ijson builds only the needed subtree into Python objects: just the
+    metric table when that is all SPEC needs (loan's voting block also holds
+    the base64 figures), else the whole (small) voting block.
+    """
+    if orjson is not None:
+        with open(precomputed_file, 'rb') as f:
+            return metric_rows(orjson.loads(f.read())['data']['voting'], dataset_name)
+    
+    if ijson is None:
+        with open(precomputed_file, 'r') as f:
+            return metric_rows(json.load(f)['data']['voting'], dataset_name)
+    
+    with open(precomputed_file, 'rb') as f:
+        _, table_key, ensemble_key = SPEC.get(dataset_name, SPEC['default'])
+        if ensemble_key is None:
+            voting = {table_key: dict(ijson.kvitems(f, f'data.voting.{table_key}', use_float=True))}
+        else:
+            voting = next(ijson.items(f, 'data.voting', use_float=True))
+    return metric_rows(voting, dataset_name)
+
+def read_precomputed_rows(precomputed_file, dataset_name, use_cache=True):
+    """
+    Read the compared voting metrics of a precomputed JSON file as metric rows
+    
+    The flattened rows are pickled into VERIFY_CACHE_DIR (not next to the JSON,
+    which is served from public/) and reused while newer than the JSON.
+    """
+    table_file = VERIFY_CACHE_DIR / f"{precomputed_file.stem}-metrics.pkl"
+    if (use_cache and table_file.exists()
+            and table_file.stat().st_mtime_ns > precomputed_file.stat().st_mtime_ns):
+        with open(table_file, 'rb') as f:
+            return pickle.load(f)
+    
+    rows = _parse_precomputed_rows(precomputed_file, dataset_name)
+    if use_cache:
+        _ensure_cache_dir()
+        with open(table_file, 'wb') as f:
+            pickle.dump(rows, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return rows
+
+def compare_results(pre_rows, fresh, dataset_name, method):
+    """Compare precomputed metric rows (from read_precomputed_rows) vs freshly computed results"""
+    # The report is collected and written once rather than printed line by line
+    out = [f"\n{'='*60}", f"Verifying: {dataset_name} - {method}", f"{'='*60}"]
     
     issues = []
     
     # Extract relevant metrics based on method
     if method == 'voting':
-        if dataset_name == 'loan':
-            # Classification metrics
-            pre_metrics = precomputed['data']['voting']['metrics']
-            fresh_metrics = fresh['voting']['metrics']
-            
-            for model_name in pre_metrics.keys():
-                print(f"\n{model_name}:")
-                for metric in ['accuracy', 'precision', 'recall', 'f1_score']:
-                    pre_val = pre_metrics[model_name][metric]
-                    fresh_val = fresh_metrics[model_name][metric]
-                    diff = abs(pre_val - fresh_val)
-                    
-                    print(f"  {metric}: pre={pre_val:.4f}, fresh={fresh_val:.4f}, diff={diff:.6f}")
-                    
-                    # Allow small tolerance due to randomness
-                    if diff > 0.01:
-                        issues.append(f"{model_name} {metric}: difference {diff:.6f} > 0.01")
-        else:
-            # Regression metrics
-            pre_models = precomputed['data']['voting']['base_models']
-            fresh_models = fresh['voting']['base_models']
-            
-            for model_name in pre_models.keys():
-                print(f"\n{model_name}:")
-                for metric in ['r2_score', 'rmse', 'mae']:
-                    pre_val = pre_models[model_name][metric]
-                    fresh_val = fresh_models[model_name][metric]
-                    diff = abs(pre_val - fresh_val)
-                    
-                    print(f"  {metric}: pre={pre_val:.4f}, fresh={fresh_val:.4f}, diff={diff:.6f}")
-                    
-                    if diff > 0.01:
-                        issues.append(f"{model_name} {metric}: difference {diff:.6f} > 0.01")
-            
-            # Check ensemble performance
-            print(f"\nEnsemble Performance:")
-            pre_ens = precomputed['data']['voting']['ensemble_performance']
-            fresh_ens = fresh['voting']['ensemble_performance']
-            for metric in ['r2_score', 'rmse', 'mae']:
-                pre_val = pre_ens[metric]
-                fresh_val = fresh_ens[metric]
-                diff = abs(pre_val - fresh_val)
-                print(f"  {metric}: pre={pre_val:.4f}, fresh={fresh_val:.4f}, diff={diff:.6f}")
-                
-                if diff > 0.01:
-                    issues.append(f"Ensemble {metric}: difference {diff:.6f} > 0.01")
+        fresh_rows = metric_rows(fresh['voting'], dataset_name)
+        
+        # One (models x metrics) array per side, diffed in a single pass; the
+        # absolute value is taken in place so no intermediate array is kept
+        model_names = list(pre_rows)
+        metric_names = list(pre_rows[model_names[0]])
+        pre_arr = np.array([[pre_rows[name][metric] for metric in metric_names] for name in model_names])
+        fresh_arr = np.array([[fresh_rows[name][metric] for metric in metric_names] for name in model_names])
+        diff = np.subtract(pre_arr, fresh_arr)
+        np.abs(diff, out=diff)
+        
+        for i, model_name in enumerate(model_names):
+            out.append(f"\n{model_name}:")
+            out.extend(f"  {metric}: pre={pre_arr[i, j]:.4f}, fresh={fresh_arr[i, j]:.4f}, diff={diff[i, j]:.6f}"
+                       for j, metric in enumerate(metric_names))
+        
+        # Seeded runs reproduce the precomputed floats up to rounding; TOLERANCE
+        # only has to absorb changes in the models or libraries themselves
+        if np.allclose(pre_arr, fresh_arr, rtol=0.0, atol=REPRODUCED_TOLERANCE):
+            out.append(f"\nAll metrics reproduce the precomputed values (within {REPRODUCED_TOLERANCE:g})")
+        issues = [f"{model_names[i]} {metric_names[j]}: difference {diff[i, j]:.6f} > {TOLERANCE}"
+                  for i, j in np.argwhere(~np.isclose(pre_arr, fresh_arr, rtol=0.0, atol=TOLERANCE))]
     
+    sys.stdout.write('\n'.join(out) + '\n')
     return issues
 
-def verify_dataset(dataset_name, csv_file):
-    """Verify results for a single dataset"""
+def cached_run(csv_path, method, config, classification, use_cache=True, n_jobs=-1, force=False):
+    """
+    Run the fresh ensemble computation, reusing the result of an identical earlier run
+    
+    Runs are keyed by inputs_sha256 (the CSV bytes, the ML code sources and
+    the library versions) and the run settings. Only contents count, so an
+    unchanged dataset is verified without retraining even after a checkout
+    or touch rewrites the files' mtimes.
+    
+    Args:
+        csv_path: Path to the dataset CSV
+        method: Ensemble method for the classification runner, meta-learner for regression
+        config: Classification config dictionary (ignored for regression)
+        classification: Use the classification runner
+        use_cache: Read and write VERIFY_CACHE_DIR, and the dataset and model
+            caches the runner keeps
+        n_jobs: Cores for model training (not part of the cache key)
+        force: Retrain even when a cached run exists, bypassing the dataset and
+            model caches too (VERIFY_CACHE_DIR is still refreshed)
+    
+    Returns:
+        Results dictionary from the runner
+    """
+    key = hashlib.sha1(repr((inputs_sha256(csv_path), method, sorted(config.items()),
+                             classification)).encode()).hexdigest()
+    cache_file = VERIFY_CACHE_DIR / f"{key}.pkl"
+    if use_cache and not force and cache_file.exists():
+        print("Inputs unchanged since the last verification, reusing its fresh run (--force to retrain)")
+        return joblib.load(cache_file)
+    
+    # A fresh run must not reload what precompute stored: the preprocessed
+    # dataset and the fitted models are rebuilt from the CSV
+    runner_cache = use_cache and not force
+    if classification:
+        fresh = run_classification_ensemble(str(csv_path), method,
+                                            {**config, 'n_jobs': n_jobs, 'use_cache': runner_cache})
+    else:
+        fresh = run_regression_ensemble(str(csv_path), method, n_jobs=n_jobs, use_cache=runner_cache)
+    
+    if use_cache:
+        _ensure_cache_dir()
+        joblib.dump(fresh, cache_file)
+    return fresh
+
+def read_recorded_inputs():
+    """
+    {dataset_name: (inputs_sha256, voting file sha256)} recorded in index.json
+    when the results were precomputed (None for a value it lacks)
+    """
+    try:
+        with open(PRECOMP_DIR / 'index.json', 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    file_digests = {entry['file']: entry.get('sha256') for entry in index.get('combinations', [])}
+    return {name: (inputs, file_digests.get(precomputed_file_for(name).name))
+            for name, inputs in index.get('inputs', {}).items()}
+
+def precomputed_file_for(dataset_name):
+    """Path of a dataset's precomputed voting results"""
+    return PRECOMP_DIR / f'{dataset_name}-voting.json'
+
+async def _read_all_precomputed(dataset_names, use_cache=True):
+    """
+    Read every dataset's precomputed metric rows concurrently in threads
+    
+    A file that fails to read maps to None, so the dataset's own worker reads
+    it again and reports the error alongside its other output.
+    """
+    results = await asyncio.gather(*[asyncio.to_thread(read_precomputed_rows, precomputed_file_for(name), name, use_cache)
+                                     for name in dataset_names], return_exceptions=True)
+    return {name: None if isinstance(rows, Exception) else rows for name, rows in zip(dataset_names, results)}
+
+def verify_dataset(dataset_name, csv_file, use_cache=True, n_jobs=-1, force=False, precomputed=None,
+                   recorded_inputs=None):
+    """
+    Verify results for a single dataset
+    
+    precomputed is its metric rows, if already read. recorded_inputs is the
+    (inputs_sha256, voting file sha256) pair index.json recorded for it: when
+    both match, the precomputed file is unmodified and was generated from this
+    exact data, code and library versions, so retraining is skipped unless
+    force is set.
+    """
     print(f"\n{'#'*60}")
     print(f"# VERIFYING DATASET: {dataset_name.upper()}")
     print(f"{'#'*60}")
     
-    csv_path = Path(__file__).parent / 'data' / csv_file
+    csv_path = DATA_DIR / csv_file
+    
+    if (use_cache and not force and recorded_inputs and None not in recorded_inputs
+            and recorded_inputs == (inputs_sha256(csv_path), file_sha256(precomputed_file_for(dataset_name)))):
+        print("\n[OK] Precomputed results are unmodified and come from the current data, code and "
+              "libraries; retraining skipped (--force to retrain)")
+        return []
     
     all_issues = []
     
     # Test voting
     print(f"\n--- Testing Voting ---")
-    precomputed_file = Path(__file__).parent / 'public' / 'precomputed-results' / f'{dataset_name}-voting.json'
-    
-    with open(precomputed_file, 'r') as f:
-        precomputed = json.load(f)
+    pre_rows = precomputed
+    if pre_rows is None:
+        pre_rows = read_precomputed_rows(precomputed_file_for(dataset_name), dataset_name, use_cache)
     
     # Run fresh computation
     if dataset_name == 'loan':
-        config = {'meta_learner': 'linear', 'voting_strategy': 'soft'}
-        fresh = run_classification_ensemble(str(csv_path), 'voting', config)
+        config = {'meta_learner': 'linear', 'voting_strategy': 'soft', 'random_state': RANDOM_STATE}
+        fresh = cached_run(csv_path, 'voting', config, classification=True,
+                           use_cache=use_cache, n_jobs=n_jobs, force=force)
     else:
-        fresh = run_regression_ensemble(str(csv_path), 'linear')
+        fresh = cached_run(csv_path, 'linear', {}, classification=False,
+                           use_cache=use_cache, n_jobs=n_jobs, force=force)
     
-    issues = compare_results(precomputed, fresh, dataset_name, 'voting')
+    issues = compare_results(pre_rows, fresh, dataset_name, 'voting')
     all_issues.extend(issues)
     
     if issues:
@@ -113,8 +276,32 @@ def verify_dataset(dataset_name, csv_file):
     
     return all_issues
 
+def _verify_captured(dataset_name, csv_file, use_cache, n_jobs, force, precomputed, recorded_inputs):
+    """
+    Run verify_dataset in a worker with its report captured, so parallel datasets don't interleave
+    
+    Returns (issues, report, error). If verification raises, the error is
+    caught here so the report printed up to that point is still returned:
+    issues is then None and error is (message, formatted traceback).
+    """
+    buffer = io.StringIO()
+    try:
+        with redirect_stdout(buffer):
+            issues = verify_dataset(dataset_name, csv_file, use_cache, n_jobs, force, precomputed,
+                                    recorded_inputs)
+    except Exception as e:
+        return None, buffer.getvalue(), (str(e), traceback.format_exc())
+    return issues, buffer.getvalue(), None
+
 def main():
     """Main verification function"""
+    parser = argparse.ArgumentParser(description="Verify precomputed results against fresh runs")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Retrain every model, without reading or writing any cache")
+    parser.add_argument('--force', action='store_true',
+                        help="Retrain every model even when the inputs match the recorded ones, refreshing the cached runs")
+    args = parser.parse_args()
+    
     print("\n" + "="*60)
     print("RESULTS VERIFICATION SCRIPT")
     print("="*60)
@@ -130,14 +317,38 @@ def main():
         ('loan', 'Loan Approval.csv')
     ]
     
-    for dataset_name, csv_file in datasets:
-        try:
-            issues = verify_dataset(dataset_name, csv_file)
-            all_issues.extend([(dataset_name, issue) for issue in issues])
-        except Exception as e:
-            print(f"\n[ERROR] verifying {dataset_name}: {str(e)}")
-            import traceback
-            traceback.print_exc()
+    # Datasets are independent, so they train in parallel; each worker gets
+    # an equal share of the cores for its own model fits
+    max_workers = min(len(datasets), os.cpu_count() or 1)
+    n_jobs = max(1, (os.cpu_count() or 1) // max_workers)
+    dataset_issues = {}
+    failures = []  # (dataset_name, formatted traceback), written once after the summary
+    # The small precomputed files are read up front, overlapping their I/O
+    precomputed = asyncio.run(_read_all_precomputed([name for name, _ in datasets], not args.no_cache))
+    recorded_inputs = read_recorded_inputs()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_verify_captured, dataset_name, csv_file, not args.no_cache, n_jobs,
+                                   args.force, precomputed[dataset_name],
+                                   recorded_inputs.get(dataset_name)): dataset_name
+                   for dataset_name, csv_file in datasets}
+        
+        for future in as_completed(futures):
+            dataset_name = futures[future]
+            try:
+                issues, report, error = future.result()
+            except Exception as e:
+                # The worker process itself failed, so there is no report
+                report, error = '', (str(e), traceback.format_exc())
+            sys.stdout.write(report)
+            if error:
+                print(f"\n[ERROR] verifying {dataset_name}: {error[0]}")
+                failures.append((dataset_name, error[1]))
+                continue
+            dataset_issues[dataset_name] = issues
+    
+    # Summary in dataset order, whatever order the workers finished in
+    for dataset_name, _ in datasets:
+        all_issues.extend([(dataset_name, issue) for issue in dataset_issues.get(dataset_name, [])])
     
     # Final summary
     print(f"\n{'='*60}")
@@ -153,6 +364,11 @@ def main():
         print("   Precomputed results are accurate!")
     
     print("\n")
+    
+    # Tracebacks are held back so they don't split the dataset reports
+    if failures:
+        sys.stdout.flush()
+        sys.stderr.write(''.join(f"Traceback for {name}:\n{tb}\n" for name, tb in failures))
 
 if __name__ == '__main__':
     main()